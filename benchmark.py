@@ -0,0 +1,202 @@
+#!/usr/bin/python
+"""
+benchmark.py
+
+Times jumpstart.py on synthetic templates of configurable shape, and prints
+the results as JSON, so that changes to the generator can be compared across
+commits.
+
+Usage: python benchmark.py [--files N] [--size BYTES] [--density D]
+                           [--depth N] [--repeat N] [--output results.json]
+"""
+
+__version__ = "0.0.1"
+
+__copyright__ = "Copyright 2015-2016, SBRE"
+__author__ = 'ekroeger'
+__email__ = 'ekroeger@aldebaran.com'
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+
+import jumpstart
+
+TEMPLATE_NAME = "bench-template"
+
+# Extensions of the synthetic files; all but the last two are reprocessed
+EXTENSIONS = [".py", ".js", ".html", ".xml", ".png", ".css"]
+
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+
+
+def make_template(root, files, size, density, depth, seed=0):
+    """Creates a synthetic template in root/TEMPLATE_NAME.
+
+    files is the number of files, size their size in bytes, density the
+    number of tokens (template name, ALMyService, myservice) per kilobyte,
+    and depth the number of nested folders files are spread over.
+    Returns the path of the template.
+    """
+    rand = random.Random(seed)
+    path = os.path.join(root, TEMPLATE_NAME)
+    tokens = [TEMPLATE_NAME] + jumpstart.SERVICE_TOKENS
+    folders = [""]
+    for level in range(depth):
+        folders.append(os.path.join(folders[-1], "level%d" % level))
+    for number in range(files):
+        folder = os.path.join(path, folders[number % len(folders)])
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # Some file names contain a token, so they get renamed too
+        name = "myservice%d" % number if number % 10 == 0 else "file%d" % number
+        filepath = os.path.join(folder, name + EXTENSIONS[number % len(EXTENSIONS)])
+        chunks = []
+        length = 0
+        while length < size:
+            if density and rand.random() < density * len(FILLER) / 1024.0:
+                chunk = " %s " % rand.choice(tokens)
+            else:
+                chunk = FILLER
+            chunks.append(chunk)
+            length += len(chunk)
+        with open(filepath, "wb") as f:
+            f.write("".join(chunks)[:size])
+    return path
+
+
+def timed(function, *args, **kwargs):
+    "Returns the duration of a call, in seconds."
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def quiet(function, *args, **kwargs):
+    "Calls a function with stdout discarded (jumpstart reports every file)."
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def bench_phases(root, jobs=1):
+    """Times each phase of a generation, on the template made in root.
+
+    Returns a dict of durations in seconds.
+    """
+    results = {}
+    outputs = os.path.join(root, "output")
+    index_path = os.path.join(root, "." + TEMPLATE_NAME + ".tokens.json")
+    if os.path.exists(index_path):
+        os.unlink(index_path)
+    if os.path.exists(outputs):
+        shutil.rmtree(outputs)
+    # generate(), with and without a token index
+    results["generate_cold"] = timed(quiet, jumpstart.generate, TEMPLATE_NAME,
+                                     "cold", "ALBenchService", jobs)
+    results["generate_warm"] = timed(quiet, jumpstart.generate, TEMPLATE_NAME,
+                                     "warm", "ALBenchService", jobs)
+    results["generate_merge"] = timed(quiet, jumpstart.generate, TEMPLATE_NAME,
+                                      "warm", "ALBenchService", jobs)
+    # rename_in_folder, on a plain copy of the template
+    copy = os.path.join(outputs, "inplace")
+    shutil.copytree(os.path.join(root, TEMPLATE_NAME), copy)
+    plan = jumpstart.make_plan(TEMPLATE_NAME, "inplace", "ALBenchService")
+    results["rename_in_folder"] = timed(quiet, jumpstart.rename_in_folder,
+                                        copy, plan)
+    # rename_in_file, on every reprocessed file of another copy
+    copy = os.path.join(outputs, "perfile")
+    shutil.copytree(os.path.join(root, TEMPLATE_NAME), copy)
+    filepaths = [os.path.join(dirpath, filename)
+                 for dirpath, _, filenames in os.walk(copy)
+                 for filename in filenames
+                 if os.path.splitext(filename)[-1].lower()
+                 in jumpstart.FILETYPES_TO_REPROCESS]
+    start = time.time()
+    for filepath in filepaths:
+        jumpstart.rename_in_file(filepath, plan)
+    results["rename_in_file_total"] = time.time() - start
+    results["rename_in_file_mean"] = \
+        results["rename_in_file_total"] / max(len(filepaths), 1)
+    return results
+
+
+def git_revision():
+    "Returns the current git commit of jumpstart.py, if known."
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(jumpstart.__file__)),
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(files=200, size=4096, density=1.0, depth=3, repeat=3,
+                  jobs=1):
+    """Builds a synthetic template, and times generations from it.
+
+    Every phase is run repeat times, and the best time is kept. Returns a
+    dict of results, ready to be dumped as JSON.
+    """
+    root = tempfile.mkdtemp(prefix="jumpstart-bench-")
+    templates, output = jumpstart.TEMPLATES, jumpstart.OUTPUT
+    jumpstart.TEMPLATES = root
+    jumpstart.OUTPUT = os.path.join(root, "output")
+    try:
+        make_template(root, files, size, density, depth)
+        runs = [bench_phases(root, jobs) for _ in range(repeat)]
+    finally:
+        jumpstart.TEMPLATES, jumpstart.OUTPUT = templates, output
+        shutil.rmtree(root)
+    return {
+        "revision": git_revision(),
+        "jumpstart_version": jumpstart.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "shape": {"files": files, "size": size, "density": density,
+                  "depth": depth, "jobs": jobs, "repeat": repeat},
+        "seconds": dict((phase, min(run[phase] for run in runs))
+                        for phase in runs[0]),
+    }
+
+
+def run_with_sysargs():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Times jumpstart.py on a synthetic template.')
+    parser.add_argument('--files', type=int, default=200,
+                        help='number of files in the template')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='size of each file, in bytes')
+    parser.add_argument('--density', type=float, default=1.0,
+                        help='tokens per kilobyte of file')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='number of nested folders')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per phase (the best one is kept)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='jobs passed to jumpstart.generate')
+    parser.add_argument('--output', type=str,
+                        help='write the JSON results to this file')
+    args = parser.parse_args()
+    results = run_benchmark(args.files, args.size, args.density, args.depth,
+                            args.repeat, args.jobs)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print text
+
+if __name__ == "__main__":
+    run_with_sysargs()
@@ -13,44 +13,206 @@ __author__ = 'ekroeger'
 __email__ = 'ekroeger@aldebaran.com'
 
 import os
+import sys
+
+TEMPLATES = "templates"
+OUTPUT = "output"
+LAYERS = "layers"
+
+
+def template_names():
+    "Returns the names of the available templates."
+    return sorted(name for name in os.listdir(TEMPLATES)
+                  if not name.startswith(".")
+                  and os.path.isdir(os.path.join(TEMPLATES, name)))
+
+def complete_template_names():
+    """Answers shell completion of the first argument, if that's what's asked.
+
+    Tab completion runs this whole script every time; completing a template
+    name only needs the list of templates, so this is done before importing
+    anything else (argcomplete itself included). Uses the argcomplete
+    protocol; returns False if the completion is for something else.
+    """
+    comp_line = os.environ.get("COMP_LINE", "")
+    line = comp_line[:int(os.environ.get("COMP_POINT", len(comp_line)))]
+    words = line.split()
+    if not line or line[-1].isspace():
+        words.append("")
+    # _ARGCOMPLETE is the position of the script in the line (i.e. 2 for
+    # "python jumpstart.py")
+    words = words[max(int(os.environ.get("_ARGCOMPLETE") or 1) - 1, 0):]
+    if len(words) != 2 or words[1][:1] in ("-", "'", '"') \
+            or "\\" in words[1]:
+        return False
+    prefix = words[1]
+    try:
+        names = template_names() + ["batch", "list", "watch"]
+    except OSError:
+        return False
+    completions = [name for name in names if name.startswith(prefix)]
+    separator = os.environ.get("_ARGCOMPLETE_IFS", "\013")
+    if "_ARGCOMPLETE_STDOUT_FILENAME" in os.environ:
+        output = open(os.environ["_ARGCOMPLETE_STDOUT_FILENAME"], "w")
+    else:
+        output = os.fdopen(8, "w")
+    output.write(separator.join(completions))
+    output.close()
+    return True
+
+if "_ARGCOMPLETE" in os.environ and complete_template_names():
+    os._exit(0)
+
+import time
 import shutil
 import re
+import json
+import hashlib
+import threading
+import contextlib
+import fnmatch
 
-import distutils.dir_util
-
+# Only needed (and imported) when the shell asks for completions
 argcomplete = None
-try:
-    import argcomplete
-except Exception as e:
-    pass
-
-TEMPLATES = "templates"
-OUTPUT = "output"
+if "_ARGCOMPLETE" in os.environ:
+    try:
+        import argcomplete
+    except Exception as e:
+        pass
 
 FILETYPES_TO_REPROCESS = [".xar", ".pml", ".manifest", ".py", ".js", ".json",
                           ".xml", ".html", ".top", ".dlg"]
+
+# Optional template settings (description, layers), at the root of a template
+TEMPLATE_CONFIG = "template.json"
+
+# Registry of all templates, generated in TEMPLATES (see Registry)
+REGISTRY = "index.json"
+
+# Temporary and backup files of editors, never part of a template
+EDITOR_FILES = ["*.swp", "*.swo", "*.swx", "*~", ".#*", "#*#", "4913",
+                ".*.kate-swp", ".DS_Store"]
+
+# Words replaced when a service name is given (see make_plan)
+SERVICE_TOKENS = ["ALMyService", "myservice"]
+
+# ioctl for cloning a file on copy-on-write filesystems (Linux btrfs, XFS...)
+FICLONE = 0x40049409
+
+# Cache of generated projects (see OutputCache), and its default disk budget
+CACHE = os.environ.get("JUMPSTART_CACHE",
+                       os.path.join(os.path.expanduser("~"), ".cache",
+                                    "jumpstart"))
+CACHE_BUDGET = 512 * 1024 * 1024
+
+
+class Stats(object):
+    """Counters and timers describing a run (shown with --stats).
+
+    Times are per phase, summed over all threads when running with --jobs.
+    """
+    COUNTERS = ["files_scanned", "files_rewritten", "files_copied",
+                "bytes_read", "bytes_written"]
+    PHASES = ["scan", "rewrite", "copy", "rename"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "Sets all counters and timers back to zero."
+        with self.lock:
+            self.counts = dict((name, 0) for name in self.COUNTERS)
+            self.times = dict((phase, 0.0) for phase in self.PHASES)
+            self.start = time.time()
+
+    def add(self, **counts):
+        "Increments counters, i.e. STATS.add(files_copied=1)."
+        with self.lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    @contextlib.contextmanager
+    def timing(self, phase):
+        "Context manager adding the time spent in it to a phase."
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            with self.lock:
+                self.times[phase] += duration
+
+    def report(self):
+        "Returns a printable summary."
+        lines = ["%-16s %d" % (name, self.counts[name])
+                 for name in self.COUNTERS]
+        lines += ["%-16s %.3fs" % ("time_" + phase, self.times[phase])
+                  for phase in self.PHASES]
+        lines.append("%-16s %.3fs" % ("time_total", time.time() - self.start))
+        return "\n".join(lines)
+
+# Statistics of the current run
+STATS = Stats()
                           
 
-def rename_in_file(filepath, sourceword, destword):
-    sourcere = re.compile(r"\b" + sourceword + r"\b")
-    # Does this pattern even occur in this file? (most of the time, it won't)
-    with open(filepath) as f:
-        if not any(sourcere.search(line) for line in f):
-            return False# We're done here.
-    # pattern is in the file, so perform replace operation.
-
-    with open(filepath) as f:
-        temp_filepath = filepath + ".tmp"
-        out = open(temp_filepath, "w")
-        for line in f:
-            out.write(sourcere.sub(destword, line))
-        f.close()
-        out.close()
-        os.unlink(filepath)
-        os.rename(temp_filepath, filepath)
+class SubstitutionPlan(object):
+    """All the (sourceword, destword) replacements to apply to a template.
+
+    Every word is matched by a single compiled regex, so each file (and file
+    name) only needs to be processed once, whatever the number of words.
+    """
+
+    def __init__(self, substitutions):
+        self.substitutions = []
+        self.replacements = {}
+        for sourceword, destword in substitutions:
+            if sourceword not in self.replacements:
+                self.substitutions.append((sourceword, destword))
+                self.replacements[sourceword] = destword
+        # Longest words first, so a word is never shadowed by its own prefix
+        words = sorted(self.replacements, key=len, reverse=True)
+        alternation = "|".join(re.escape(word) for word in words)
+        self.wordre = re.compile(r"\b(?:" + alternation + r")\b")
+        self.namere = re.compile(alternation)
+
+    def _replace(self, match):
+        return self.replacements[match.group(0)]
+
+    def sub(self, text):
+        "Returns (newtext, count), replacing whole words only."
+        return self.wordre.subn(self._replace, text)
+
+    def rename(self, filename):
+        "Returns the new name for a file (any occurrence is replaced)."
+        return self.namere.sub(self._replace, filename)
+
+
+def make_plan(sourcename, destname, servicename=None):
+    "Returns the SubstitutionPlan for generating destname from sourcename."
+    substitutions = [(sourcename, destname)]
+    if servicename:
+        # script name (used by ALServiceManager) should be underscore
+        scriptname = servicename.lower()
+        # service name (used in ServiceDirectory) should be capitalized
+        if not servicename[0].isupper():
+            servicename = servicename.capitalize()
+        substitutions.append(("ALMyService", servicename))
+        substitutions.append(("myservice", scriptname))
+    return SubstitutionPlan(substitutions)
+
+
+def rename_in_file(filepath, plan):
+    with open(filepath, "rb") as f:
+        content = f.read()
+    content, count = plan.sub(content)
+    if not count:
+        return False # Most of the time, no word occurs in the file.
+    with open(filepath, "wb") as f:
+        f.write(content)
     return True
 
-def rename_in_folder(folder, sourceword, destword):
+def rename_in_folder(folder, plan):
     files = list(os.listdir(folder))
     for filename in files:
         if filename.startswith("."):
@@ -58,66 +220,1246 @@ def rename_in_folder(folder, sourceword, destword):
         filepath = os.path.join(folder, filename)
         # 1) replace everything inside
         if os.path.isdir(filepath):
-            rename_in_folder(filepath, sourceword, destword)
+            rename_in_folder(filepath, plan)
         else:
             extension = os.path.splitext(filename)[-1].lower()
             if extension in FILETYPES_TO_REPROCESS:
-                if rename_in_file(filepath, sourceword, destword):
+                if rename_in_file(filepath, plan):
                     print "Renamed inside", filename
         # 2) rename if needed
-        if sourceword in filename:
-            newfilename = filename.replace(sourceword, destword)
+        newfilename = plan.rename(filename)
+        if newfilename != filename:
             os.rename(filepath, os.path.join(folder, newfilename))
             print "Renamed", filename
 
-def generate(sourcename, destname, servicename=None):
-    "Generate a folder based on a template, or add to an existing one."
+# Profilers of the worker threads, while profiling (see run_instrumented)
+_thread_profilers = None
+
+def profiled(function):
+    """Returns function, profiled in whatever thread runs it if a run is
+    being profiled (cProfile only profiles the thread it's started in)."""
+    profilers = _thread_profilers
+    if profilers is None:
+        return function
+
+    def run(*args, **kwargs):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            profilers.append(profiler)
+    return run
+
+def map_jobs(function, items, jobs=1):
+    """Like map(), spread over jobs threads if jobs > 1.
+
+    Results are returned in the order of items, whatever the order in which
+    they were completed. The first exception raised by function is re-raised.
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    todo = iter(enumerate(items))
+    lock = threading.Lock()
+
+    def worker():
+        while not errors:
+            with lock:
+                try:
+                    position, item = next(todo)
+                except StopIteration:
+                    return
+            try:
+                results[position] = function(item)
+            except Exception:
+                errors.append(sys.exc_info())
+    threads = [threading.Thread(target=profiled(worker))
+               for _ in range(min(jobs, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+def imap_jobs(function, items, jobs=1, window=None):
+    """Like map_jobs, but yields results in order as soon as they are ready.
+
+    At most window items (2 * jobs by default) are being processed or
+    waiting to be consumed at any time, so that results don't pile up in
+    memory when they are consumed slowly.
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        for item in items:
+            yield function(item)
+        return
+    slots = threading.Semaphore(window or 2 * jobs)
+    condition = threading.Condition()
+    done = {}
+    stopped = []
+    todo = iter(enumerate(items))
+
+    def worker():
+        while True:
+            slots.acquire()
+            with condition:
+                if stopped:
+                    return
+                try:
+                    position, item = next(todo)
+                except StopIteration:
+                    slots.release()
+                    return
+            try:
+                result = True, function(item)
+            except Exception:
+                result = False, sys.exc_info()
+            with condition:
+                done[position] = result
+                condition.notify_all()
+    threads = [threading.Thread(target=profiled(worker))
+               for _ in range(min(jobs, len(items)))]
+    for thread in threads:
+        thread.start()
+    try:
+        for position in range(len(items)):
+            with condition:
+                while position not in done:
+                    condition.wait()
+                succeeded, result = done.pop(position)
+            slots.release()
+            if not succeeded:
+                raise result[0], result[1], result[2]
+            yield result
+    finally:
+        # Stops the workers, waking up those waiting for a slot
+        with condition:
+            stopped.append(True)
+        for thread in threads:
+            slots.release()
+        for thread in threads:
+            thread.join()
+
+def list_template(sourcepath):
+    """Lists the content of a template (or layer) folder, parents first.
+
+    Returns (sourcerel, isdir, keep, reprocess, source) tuples, source being
+    the path of the file or folder; keep is set for hidden files and folders
+    (and their content), which are copied as they are, neither renamed nor
+    rewritten. The template's TEMPLATE_CONFIG and EDITOR_FILES are not part
+    of it.
+    """
+    entries = []
+
+    def visit(sourcerel, verbatim):
+        for filename in sorted(os.listdir(os.path.join(sourcepath, sourcerel))):
+            if not sourcerel and filename == TEMPLATE_CONFIG:
+                continue
+            if any(fnmatch.fnmatch(filename, pattern)
+                   for pattern in EDITOR_FILES):
+                continue
+            keep = verbatim or filename.startswith(".")
+            childsource = os.path.join(sourcerel, filename)
+            source = os.path.join(sourcepath, childsource)
+            if os.path.isdir(source):
+                entries.append((childsource, True, keep, False, source))
+                visit(childsource, keep)
+            else:
+                extension = os.path.splitext(filename)[-1].lower()
+                reprocess = not keep and extension in FILETYPES_TO_REPROCESS
+                entries.append((childsource, False, keep, reprocess, source))
+    visit("", False)
+    return entries
+
+def compose_template(sourcepaths):
+    """Lists several folders (i.e. a template's layers, then the template)
+    as if they were one.
+
+    A file replaces the file with the same path in the previous folders.
+    Returns (entries, folders): the merged entries of list_template, parents
+    first, and the paths of all the folders listed (roots included).
+    """
+    merged = {}
+    folders = []
+    for sourcepath in sourcepaths:
+        folders.append(sourcepath)
+        for entry in list_template(sourcepath):
+            previous = merged.get(entry[0])
+            if previous and previous[1] != entry[1]:
+                raise Exception, "Both a file and a folder: " + repr(entry[4])
+            if entry[1]:
+                folders.append(entry[4])
+            merged[entry[0]] = entry
+    entries = sorted(merged.values(), key=lambda entry: entry[0].split(os.sep))
+    return entries, folders
+
+def plan_tree(entries, plan):
+    """Gives their final names to the entries listed by list_template.
+
+    Returns (folders, files): folders are (sourcerel, destrel) pairs, files
+    are (sourcerel, destrel, reprocess, source), both parents first.
+    """
+    folders = []
+    files = []
+    destrels = {"": ""}
+    with STATS.timing("rename"):
+        for sourcerel, isdir, keep, reprocess, source in entries:
+            parent, filename = os.path.split(sourcerel)
+            newfilename = filename if keep else plan.rename(filename)
+            destrel = os.path.join(destrels[parent], newfilename)
+            if isdir:
+                destrels[sourcerel] = destrel
+                folders.append((sourcerel, destrel))
+            else:
+                files.append((sourcerel, destrel, reprocess, source))
+    return folders, files
+
+class TokenIndex(object):
+    """Cache of where a template's tokens occur in its files.
+
+    For every file, the index keeps its mtime, size and sha1, and the byte
+    offsets of each token (the template name, and SERVICE_TOKENS). It is
+    stored next to the template, as templates/.<template>.tokens.json, and
+    an entry is only recomputed when the file's mtime or size changed and
+    its hash doesn't match anymore.
+    """
+    VERSION = 1
+
+    def __init__(self, path, tokens):
+        self.path = path
+        self.tokens = list(tokens)
+        self.files = {}
+        self.modified = False
+
+    @classmethod
+    def load(cls, sourcename):
+        "Loads the index of a template (empty if missing or outdated)."
+        path = os.path.join(TEMPLATES, "." + sourcename + ".tokens.json")
+        index = cls(path, [sourcename] + SERVICE_TOKENS)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data["version"] == cls.VERSION and data["tokens"] == index.tokens:
+                index.files = data["files"]
+        except (IOError, ValueError, KeyError):
+            pass # No usable index, everything will be scanned.
+        return index
+
+    def save(self):
+        "Writes the index, if it changed (silently ignored if read-only)."
+        if not self.modified:
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump({"version": self.VERSION, "tokens": self.tokens,
+                           "files": self.files}, f, sort_keys=True)
+            os.rename(temp_path, self.path)
+            self.modified = False
+        except (IOError, OSError):
+            pass
+
+    def _scan(self, filepath, reprocess, entry):
+        "Returns an up-to-date entry for a file (entry is the cached one)."
+        stat = os.stat(filepath)
+        if entry and entry["mtime"] == stat.st_mtime \
+                and entry["size"] == stat.st_size:
+            return entry
+        with STATS.timing("scan"):
+            with open(filepath, "rb") as f:
+                content = f.read()
+            STATS.add(files_scanned=1, bytes_read=len(content))
+            sha1 = hashlib.sha1(content).hexdigest()
+            if entry and entry["sha1"] == sha1:
+                return dict(entry, mtime=stat.st_mtime)
+            occurrences = {}
+            if reprocess:
+                for token in self.tokens:
+                    tokenre = re.compile(r"\b" + re.escape(token) + r"\b")
+                    offsets = [m.start() for m in tokenre.finditer(content)]
+                    if offsets:
+                        occurrences[token] = offsets
+        return {"mtime": stat.st_mtime, "size": stat.st_size, "sha1": sha1,
+                "tokens": occurrences}
+
+    def refresh(self, entries, jobs=1):
+        "Updates the index for the files listed by list_template."
+        files = [entry for entry in entries if not entry[1]]
+
+        def scan(fileentry):
+            sourcerel, _, _, reprocess, source = fileentry
+            key = sourcerel.replace(os.sep, "/")
+            cached = self.files.get(key)
+            return key, cached, self._scan(source, reprocess, cached)
+        entries = {}
+        for key, cached, entry in map_jobs(scan, files, jobs):
+            entries[key] = entry
+            if entry is not cached:
+                self.modified = True
+        if set(entries) != set(self.files):
+            self.modified = True
+        self.files = entries
+
+    def needs_rewrite(self, sourcerel, plan):
+        "Whether any word of the plan occurs in the given file."
+        entry = self.files.get(sourcerel.replace(os.sep, "/"))
+        if entry is None:
+            return True
+        for word in plan.replacements:
+            if word not in self.tokens or word in entry["tokens"]:
+                return True
+        return False
+
+class Registry(object):
+    """The registry of templates, generated as templates/index.json.
+
+    For each template, it keeps its description (from its TEMPLATE_CONFIG),
+    number of files, total size, and the files in which each token occurs
+    (see TokenIndex), along with its listing and the mtimes of its folders.
+    A template's entry is refreshed when it is used for generation, and when
+    the mtime of any of its folders (or of its TEMPLATE_CONFIG) changed; as
+    long as they didn't, the template doesn't need to be walked again.
+    """
+    VERSION = 2
+
+    def __init__(self):
+        self.path = os.path.join(TEMPLATES, REGISTRY)
+        self.templates = {}
+        self.modified = False
+
+    @classmethod
+    def load(cls):
+        "Loads the registry (empty if missing or outdated)."
+        registry = cls()
+        try:
+            with open(registry.path) as f:
+                data = json.load(f)
+            if data["version"] == cls.VERSION:
+                registry.templates = data["templates"]
+        except (IOError, ValueError, KeyError):
+            pass
+        return registry
+
+    def save(self):
+        "Writes the registry, if it changed (silently ignored if read-only)."
+        if not self.modified:
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump({"version": self.VERSION,
+                           "templates": self.templates}, f,
+                          sort_keys=True)
+            os.rename(temp_path, self.path)
+            self.modified = False
+        except (IOError, OSError):
+            pass
+
+    @staticmethod
+    def _mtimes(paths):
+        "Returns {path: mtime} for the given paths."
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def is_fresh(self, sourcename):
+        "Whether the entry of a template is still up to date."
+        entry = self.templates.get(sourcename)
+        if entry is None:
+            return False
+        return self._mtimes(entry["mtimes"]) == entry["mtimes"]
+
+    def listing(self, sourcename):
+        """Returns the (entries, folders) of compose_template for a template,
+        if they are still up to date, else None."""
+        if not self.is_fresh(sourcename):
+            return None
+        encoding = sys.getfilesystemencoding() or "utf-8"
+        entries = [(sourcerel.encode(encoding).replace("/", os.sep), isdir,
+                    keep, reprocess, source.encode(encoding))
+                   for sourcerel, isdir, keep, reprocess, source
+                   in self.templates[sourcename]["entries"]]
+        folders = [folder.encode(encoding)
+                   for folder in self.templates[sourcename]["folders"]]
+        return entries, folders
+
+    def update(self, template):
+        "Sets the entry of a Template (listed and indexed)."
+        config_path = os.path.join(template.path, TEMPLATE_CONFIG)
+        tokens = {}
+        for filename, cached in sorted(template.index.files.items()):
+            for token in cached["tokens"]:
+                tokens.setdefault(token, []).append(filename)
+        entry = {
+            "name": template.name,
+            "description": template.config.get("description", ""),
+            "layers": template.config.get("layers", []),
+            "files": len(template.index.files),
+            "size": sum(cached["size"]
+                        for cached in template.index.files.values()),
+            "tokens": tokens,
+            "mtimes": self._mtimes(template.folders + [config_path]),
+            "folders": template.folders,
+            "entries": [[sourcerel.replace(os.sep, "/"), isdir, keep,
+                         reprocess, source]
+                        for sourcerel, isdir, keep, reprocess, source
+                        in template.entries],
+        }
+        if self.templates.get(template.name) != entry:
+            self.templates[template.name] = entry
+            self.modified = True
+
+    def refresh(self, jobs=1):
+        """Updates the entries of all templates that changed.
+
+        Returns the entries of all templates, sorted by name.
+        """
+        names = template_names()
+        for name in list(self.templates):
+            if name not in names:
+                del self.templates[name]
+                self.modified = True
+        for name in names:
+            if not self.is_fresh(name):
+                Template(name, jobs, self)
+        self.save()
+        return [self.templates[name] for name in names]
+
+
+class Template(object):
+    """A template folder, composed with its layers, listed and indexed once.
+
+    A template can declare base layers in its TEMPLATE_CONFIG, i.e.
+    {"layers": ["base", "stk"]}: folders in LAYERS holding files shared by
+    several templates. Generation sees the layers and the template as a
+    single tree, the template's own files replacing the layers' ones.
+
+    A Template can be used for any number of generations. Its listing comes
+    from the Registry when its folders haven't changed, and the Registry is
+    updated with it.
+    """
+
+    def __init__(self, sourcename, jobs=1, registry=None):
+        self.name = sourcename
+        self.path = os.path.join(TEMPLATES, sourcename)
+        if not os.path.isdir(self.path):
+            raise Exception, "Template not found: " + repr(sourcename)
+        self.config = {}
+        config_path = os.path.join(self.path, TEMPLATE_CONFIG)
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                self.config = json.load(f)
+        self.layers = [os.path.join(LAYERS, layer)
+                       for layer in self.config.get("layers", [])]
+        for layer in self.layers:
+            if not os.path.isdir(layer):
+                raise Exception, "Layer not found: " + repr(layer)
+        save_registry = registry is None
+        if registry is None:
+            registry = Registry.load()
+        listing = registry.listing(sourcename)
+        if listing is None:
+            listing = compose_template(self.layers + [self.path])
+        self.entries, self.folders = listing
+        self.index = TokenIndex.load(sourcename)
+        self.index.refresh(self.entries, jobs)
+        self.index.save()
+        registry.update(self)
+        if save_registry:
+            registry.save()
+
+    def plan(self, plan):
+        "Returns the folders and files to create (see plan_tree)."
+        return plan_tree(self.entries, plan)
+
+def file_digest(filepath):
+    "Returns the sha1 of a file's content."
+    sha1 = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def same_content(filepath, size, sha1_getter):
+    """Whether a file has the given size and sha1.
+
+    The sha1 is only asked for (and the file only hashed) if sizes match.
+    """
+    return os.path.getsize(filepath) == size \
+        and file_digest(filepath) == sha1_getter()
+
+def reflink(source, dest):
+    "Makes dest a copy-on-write clone of source; raises if not supported."
+    import fcntl
+    with open(source, "rb") as src:
+        try:
+            with open(dest, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except (IOError, OSError):
+            os.unlink(dest)
+            raise
+    shutil.copystat(source, dest)
+
+# Link methods that failed once (e.g. filesystem doesn't support them).
+_unsupported_links = set()
+
+def link_or_copy(source, dest, hardlink=True):
+    """Makes dest a copy of source without copying data, if possible.
+
+    Tries a reflink (an independent copy-on-write clone), then a hard link
+    (dest shares source's inode, so it must never be modified in place) if
+    hardlink is set, and falls back to a plain copy.
+    """
+    for method in (reflink, os.link) if hardlink else (reflink,):
+        if method in _unsupported_links:
+            continue
+        try:
+            return method(source, dest)
+        except (IOError, OSError, ImportError):
+            _unsupported_links.add(method)
+    shutil.copy2(source, dest)
+
+def render_file(entry, plan, index=None):
+    """Returns (content, count) for a template file planned by plan_tree.
+
+    content is the final content of the file, and count the number of words
+    replaced in it. content is None for files that can be copied as they
+    are: those not reprocessed, and those a TokenIndex (if given) knows have
+    no word of the plan.
+    """
+    sourcerel, _, reprocess, source = entry
+    if not reprocess or (index and not index.needs_rewrite(sourcerel, plan)):
+        return None, 0
+    with STATS.timing("scan"):
+        with open(source, "rb") as f:
+            content = f.read()
+        STATS.add(files_scanned=1, bytes_read=len(content))
+        return plan.sub(content)
+
+def write_file(destpath, entry, plan, index=None, merge=False,
+               link=False):
+    """Writes a template file straight to its final path, with final content.
+
+    If a TokenIndex is given, files it knows have no word of the plan are
+    plainly copied instead of being scanned. When merging into an existing
+    project, files that already exist are never overwritten; they are just
+    compared (by size, then hash) with what would have been generated. With
+    link=True, files that need no rewriting are linked instead of copied
+    (see link_or_copy); only binary files (not in FILETYPES_TO_REPROCESS)
+    can be hardlinked, as text files are likely to be edited in place.
+
+    Returns (status, report lines), status being "written", or for existing
+    files "unchanged" or "kept" (kept with local changes).
+    """
+    sourcerel, destrel, reprocess, source = entry
+    dest = os.path.join(destpath, destrel)
+    filename = os.path.basename(sourcerel)
+    content, count = render_file(entry, plan, index)
+    if merge and os.path.lexists(dest):
+        if not os.path.isfile(dest):
+            return "kept", []
+        if content is not None:
+            size = len(content)
+            sha1_getter = lambda: hashlib.sha1(content).hexdigest()
+        elif index and sourcerel.replace(os.sep, "/") in index.files:
+            cached = index.files[sourcerel.replace(os.sep, "/")]
+            size = cached["size"]
+            sha1_getter = lambda: cached["sha1"]
+        else:
+            size = os.path.getsize(source)
+            sha1_getter = lambda: file_digest(source)
+        if same_content(dest, size, sha1_getter):
+            return "unchanged", []
+        return "kept", []
+    report = []
+    if content is not None:
+        with STATS.timing("rewrite"):
+            with open(dest, "wb") as f:
+                f.write(content)
+            if count:
+                shutil.copymode(source, dest)
+                report.append("Renamed inside " + filename)
+            else:
+                shutil.copystat(source, dest)
+        STATS.add(files_rewritten=bool(count), bytes_written=len(content))
+    else:
+        with STATS.timing("copy"):
+            if link:
+                link_or_copy(source, dest, hardlink=not reprocess)
+            else:
+                shutil.copy2(source, dest)
+        size = os.path.getsize(dest)
+        STATS.add(files_copied=1, bytes_read=size, bytes_written=size)
+    if os.path.basename(destrel) != filename:
+        report.append("Renamed " + filename)
+    return "written", report
+
+def write_tree(template, destpath, plan, jobs=1, verbose=True, link=False):
+    """Generates destpath from a template, writing each file exactly once.
+
+    Unlike copying the template then calling rename_in_folder, every file is
+    created directly with its final name and content. Folders are created
+    first, then files are written by a pool of jobs threads; the report is
+    printed in template order.
+
+    If destpath already exists, only the files it is missing are written,
+    and the rest of it is left untouched. Returns a dict counting files by
+    status (see write_file). The report is only printed if verbose is set.
+    """
+    index = template.index
+    folders, files = template.plan(plan)
+    merge = os.path.exists(destpath)
+    if not merge:
+        os.makedirs(destpath)
+    for sourcerel, destrel in folders:
+        folder = os.path.join(destpath, destrel)
+        if merge and os.path.lexists(folder):
+            continue
+        os.mkdir(folder)
+        if verbose and \
+                os.path.basename(destrel) != os.path.basename(sourcerel):
+            print "Renamed", os.path.basename(sourcerel)
+    results = map_jobs(
+        lambda entry: write_file(destpath, entry, plan, index,
+                                 merge, link),
+        files, jobs)
+    counts = {"written": 0, "unchanged": 0, "kept": 0}
+    for status, report in results:
+        counts[status] += 1
+        if verbose:
+            for line in report:
+                print line
+    return counts
+
+def package_members(pml_content):
+    """Lists the files of a package, from the content of its .pml file.
+
+    Paths are relative to the .pml's folder, and include the .pml's
+    manifest, behaviors, dialogs, resources, topics and translations.
+    """
+    import xml.etree.ElementTree as ElementTree
+    root = ElementTree.fromstring(pml_content)
+    members = []
+    for element in root.iter():
+        src = element.get("src")
+        if src is None or element.tag == "Path": # Path is an IgnoredPath
+            continue
+        if element.tag == "BehaviorDescription":
+            src = os.path.join(src, element.get("xar", ""))
+        members.append(os.path.normpath(src).replace(os.sep, "/"))
+    return members
+
+def write_package(template, pkgpath, plan, jobs=1, verbose=True):
+    """Generates a template straight into a .pkg (zip) archive.
+
+    No project folder is written: members are rendered in memory (by a pool
+    of jobs threads), and written to the archive in order as soon as they
+    are ready, with only a few of them in memory at a time. The members are
+    those listed in the template's .pml file, relative to the .pml's folder.
+    Returns the number of members.
+    """
+    import zipfile
+    index = template.index
+    _, files = template.plan(plan)
+    pmls = [entry for entry in files if entry[1].lower().endswith(".pml")]
+    if not pmls:
+        raise Exception, "No .pml file in template: " + repr(template.name)
+    # The shallowest .pml is the package's
+    pml = min(pmls, key=lambda entry: entry[1].count(os.sep))
+    root = os.path.dirname(pml[1])
+    by_member = dict((os.path.relpath(entry[1], root).replace(os.sep, "/"),
+                      entry) for entry in files)
+    content, _ = render_file(pml, plan, index)
+    if content is None:
+        with open(pml[3], "rb") as f:
+            content = f.read()
+    members = [os.path.basename(pml[1])]
+    for member in package_members(content):
+        if member in members:
+            continue
+        if member in by_member:
+            members.append(member)
+        elif not member.endswith(".pyc"): # .pyc are generated on the robot
+            print "Warning: %s lists %s, which is not in the template" % (
+                os.path.basename(pml[1]), member)
+
+    def render(member):
+        entry = by_member[member]
+        source = entry[3]
+        data, count = render_file(entry, plan, index)
+        if data is None:
+            with STATS.timing("copy"):
+                with open(source, "rb") as f:
+                    data = f.read()
+            STATS.add(files_copied=1, bytes_read=len(data))
+        stat = os.stat(source)
+        zinfo = zipfile.ZipInfo(member, time.localtime(stat.st_mtime)[:6])
+        zinfo.external_attr = (stat.st_mode & 0xFFFF) << 16
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        STATS.add(files_rewritten=bool(count))
+        return zinfo, data
+    temp_pkgpath = pkgpath + ".tmp"
+    archive = zipfile.ZipFile(temp_pkgpath, "w", zipfile.ZIP_DEFLATED)
+    try:
+        for zinfo, data in imap_jobs(render, members, jobs):
+            with STATS.timing("rewrite"):
+                archive.writestr(zinfo, data)
+            STATS.add(bytes_written=zinfo.compress_size)
+            if verbose:
+                print "Packaged", zinfo.filename
+    finally:
+        archive.close()
+    os.rename(temp_pkgpath, pkgpath)
+    return len(members)
+
+def generate_package(sourcename, destname, servicename=None, jobs=1,
+                     template=None, verbose=True):
+    """Generate output/<destname>.pkg from a template, with no project folder.
+
+    Returns the path of the package.
+    """
+    if not os.path.exists(OUTPUT):
+        os.mkdir(OUTPUT)
+    if template is None:
+        template = Template(sourcename, jobs)
+    pkgpath = os.path.join(OUTPUT, destname + ".pkg")
+    count = write_package(template, pkgpath,
+                          make_plan(sourcename, destname, servicename),
+                          jobs, verbose)
+    if verbose:
+        print "Done packaging", destname, "from", sourcename, \
+            "(%d files in %s)" % (count, pkgpath)
+    return pkgpath
+
+class OutputCache(object):
+    """A cache of generated projects, in CACHE, for repeated generations.
+
+    Projects are stored by key: a hash of the template's content (the sha1s
+    of the TokenIndex) and of the generation arguments, so any change to
+    the template makes a new key. Each project is kept as a <key> folder,
+    along with a <key>.json giving its size; the mtime of the latter is its
+    last use. Once stored, projects are never modified, and the least
+    recently used ones are removed when the cache exceeds its budget.
+    """
+    VERSION = 1
+
+    def __init__(self, path=CACHE, budget=CACHE_BUDGET):
+        self.path = path
+        self.budget = budget
+        self.lock = threading.Lock()
+
+    def key(self, template, destname, servicename=None):
+        "Returns the key of a project generated from a loaded Template."
+        entries = [(sourcerel, reprocess, None if isdir else
+                    template.index.files[sourcerel.replace(os.sep, "/")]["sha1"])
+                   for sourcerel, isdir, _, reprocess, _ in template.entries]
+        data = json.dumps([self.VERSION, __version__, template.name, destname,
+                           servicename, entries])
+        return hashlib.sha1(data).hexdigest()
+
+    def restore(self, key, destpath, link=False):
+        """Creates destpath from the cached project key, if there is one.
+
+        Files are reflinked when possible, or with link=True binary files
+        are hardlinked (as in write_file), else copied. Returns the number of
+        files restored, or None if the project isn't (fully) cached, i.e.
+        being evicted by another process; destpath is then not created.
+        """
+        cached = os.path.join(self.path, key)
+        try:
+            with open(cached + ".json") as f:
+                files = json.load(f).get("files")
+            os.utime(cached + ".json", None)
+        except (IOError, OSError, ValueError):
+            return None
+        if not os.path.isdir(cached):
+            self._remove(cached)
+            return None
+        restored = 0
+        try:
+            with STATS.timing("copy"):
+                for dirpath, dirnames, filenames in os.walk(cached):
+                    folder = os.path.join(destpath,
+                                          os.path.relpath(dirpath, cached))
+                    if not os.path.isdir(folder):
+                        os.makedirs(folder)
+                    for filename in filenames:
+                        extension = os.path.splitext(filename)[-1].lower()
+                        link_or_copy(os.path.join(dirpath, filename),
+                                     os.path.join(folder, filename),
+                                     link and extension
+                                     not in FILETYPES_TO_REPROCESS)
+                        restored += 1
+        except (IOError, OSError):
+            restored = None
+        if not restored or restored != (files or restored):
+            # Broken (i.e. half evicted): drop it, so it can be stored again
+            shutil.rmtree(destpath, ignore_errors=True)
+            self._remove(cached)
+            return None
+        STATS.add(files_copied=restored)
+        return restored
+
+    def store(self, key, destpath):
+        """Adds a freshly generated project to the cache, then evicts the
+        least recently used projects if over budget (errors are ignored, the
+        cache is only an optimization)."""
+        cached = os.path.join(self.path, key)
+        temp_path = "%s.%d.%d.tmp" % (cached, os.getpid(),
+                                      threading.current_thread().ident)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            shutil.copytree(destpath, temp_path)
+            sizes = [os.path.getsize(os.path.join(dirpath, filename))
+                     for dirpath, _, filenames in os.walk(temp_path)
+                     for filename in filenames]
+            with open(temp_path + ".json", "w") as f:
+                json.dump({"version": self.VERSION, "size": sum(sizes),
+                           "files": len(sizes), "source": destpath}, f)
+            os.rename(temp_path, cached)
+            os.rename(temp_path + ".json", cached + ".json")
+        except (IOError, OSError, shutil.Error):
+            # i.e. another thread or process stored it first
+            shutil.rmtree(temp_path, ignore_errors=True)
+            if os.path.exists(temp_path + ".json"):
+                os.unlink(temp_path + ".json")
+            return
+        self.evict()
+
+    def evict(self):
+        "Removes the least recently used projects until within the budget."
+        with self.lock:
+            projects = []
+            for filename in os.listdir(self.path):
+                if not filename.endswith(".json"):
+                    continue
+                metapath = os.path.join(self.path, filename)
+                try:
+                    with open(metapath) as f:
+                        size = json.load(f)["size"]
+                    projects.append((os.stat(metapath).st_mtime, size,
+                                     metapath))
+                except (IOError, OSError, ValueError, KeyError):
+                    pass
+            total = sum(size for _, size, _ in projects)
+            for _, size, metapath in sorted(projects):
+                if total <= self.budget:
+                    break
+                self._remove(metapath[:-len(".json")])
+                total -= size
+
+    @staticmethod
+    def _remove(cached):
+        "Removes a cached project, if it's still there."
+        # The metadata goes first, so the project is never restored while it
+        # is being removed
+        try:
+            os.unlink(cached + ".json")
+        except OSError:
+            pass
+        shutil.rmtree(cached, ignore_errors=True)
+
+
+def generate(sourcename, destname, servicename=None, jobs=1, template=None,
+             verbose=True, link=False, cache=None):
+    """Generate a folder based on a template, or add to an existing one.
+
+    An already loaded Template can be passed, to avoid listing and indexing
+    it again. New projects are restored from an OutputCache, if one is given
+    and has them, else stored in it. Returns the file counts of write_tree.
+    """
     if not os.path.exists(OUTPUT):
         os.mkdir(OUTPUT)
-    sourcepath = os.path.join(TEMPLATES, sourcename)
+    if template is None:
+        template = Template(sourcename, jobs)
     destpath = os.path.join(OUTPUT, destname)
-    if not os.path.exists(sourcepath):
-        raise Exception, "Template not found: " + repr(sourcename)
     project_exists = os.path.exists(destpath)
-    if project_exists:
-        shutil.move(destpath, destpath + "_TEMP")
+    if project_exists and verbose:
         print "Project already exists, only adding new files to it"
-    shutil.copytree(sourcepath, destpath)
-    rename_in_folder(destpath, sourcename, destname)
+    key = None
+    if cache and not project_exists:
+        key = cache.key(template, destname, servicename)
+        restored = cache.restore(key, destpath, link)
+        if restored is not None:
+            if verbose:
+                print "Restored", destname, "from cache (%d files)" % restored
+            return {"written": restored, "unchanged": 0, "kept": 0}
+    counts = write_tree(template, destpath,
+                        make_plan(sourcename, destname, servicename),
+                        jobs, verbose, link)
+    if key:
+        cache.store(key, destpath)
 
-    if servicename:
-        # script name (used by ALServiceManager) should be underscore
-        scriptname = servicename.lower()
-        # service name (used in ServiceDirectory) should be capitalized
-        if not servicename[0].isupper():
-            servicename = servicename.capitalize()
-        rename_in_folder(destpath, "ALMyService", servicename)
-        rename_in_folder(destpath, "myservice", scriptname)
+    if verbose:
+        if project_exists:
+            print "Added %(written)d files, %(unchanged)d already up to " \
+                "date, %(kept)d kept with local changes" % counts
+            print "Done adding to", destname, "from", sourcename, 
+        else:
+            print "Done generating", destname, "from", sourcename, 
+    return counts
 
-    if project_exists:
-        distutils.dir_util.copy_tree(destpath + "_TEMP", destpath)
-        shutil.rmtree(destpath + "_TEMP")
-        print "Done adding to", destname, "from", sourcename, 
-    else:
-        print "Done generating", destname, "from", sourcename, 
+
+def read_batch(planpath):
+    """Reads a batch file: a JSON list of projects to generate.
+
+    Each project is either a {"template": ..., "destname": ...,
+    "servicename": ...} object (servicename is optional), or a [template,
+    destname, servicename] list. Returns (template, destname, servicename)
+    tuples.
+    """
+    def to_str(value):
+        if value is None or isinstance(value, str):
+            return value
+        return value.encode("utf-8")
+    with open(planpath) as f:
+        items = json.load(f)
+    projects = []
+    for item in items:
+        if isinstance(item, dict):
+            item = [item["template"], item["destname"], item.get("servicename")]
+        if not 2 <= len(item) <= 3:
+            raise Exception, "Invalid batch entry: " + repr(item)
+        template, destname, servicename = (list(item) + [None])[:3]
+        projects.append((to_str(template), to_str(destname),
+                         to_str(servicename)))
+    destnames = [destname for _, destname, _ in projects]
+    for destname in set(destnames):
+        if destnames.count(destname) > 1:
+            raise Exception, "Project listed twice in batch: " + repr(destname)
+    return projects
+
+def generate_batch(planpath, jobs=1, link=False, cache=None):
+    """Generates all the projects of a batch file (see read_batch).
+
+    Each template is listed and indexed once, then projects are generated by
+    a pool of jobs threads (with an OutputCache, if given). Prints a summary
+    with per-project timings, and returns the number of projects that failed.
+    """
+    projects = read_batch(planpath)
+    start = time.time()
+    if not os.path.exists(OUTPUT):
+        os.mkdir(OUTPUT)
+    templates = {}
+    for sourcename, _, _ in projects:
+        if sourcename not in templates:
+            # A template that can't be loaded only fails its own projects
+            try:
+                templates[sourcename] = Template(sourcename, jobs)
+            except Exception as exc:
+                templates[sourcename] = exc
+
+    def run(project):
+        sourcename, destname, servicename = project
+        project_start = time.time()
+        try:
+            template = templates[sourcename]
+            if isinstance(template, Exception):
+                raise template
+            counts = generate(sourcename, destname, servicename,
+                              template=template, verbose=False,
+                              link=link, cache=cache)
+            result = "%(written)d written, %(unchanged)d unchanged, " \
+                "%(kept)d kept" % counts
+        except Exception as exc:
+            result = "FAILED: %s" % exc
+        return result, time.time() - project_start
+    results = map_jobs(run, projects, jobs)
+
+    failures = 0
+    for (sourcename, destname, _), (result, duration) in zip(projects, results):
+        failures += result.startswith("FAILED")
+        print "%8.3fs  %-30s %-20s %s" % (duration, destname, sourcename, result)
+    loaded = [template for template in templates.values()
+              if not isinstance(template, Exception)]
+    print "Generated %d projects from %d templates in %.3fs (%d failed)" % (
+        len(projects) - failures, len(loaded), time.time() - start, failures)
+    return failures
     
     
+class TemplateSync(object):
+    """Keeps a generated project in sync with its template, file by file.
+
+    For every template file, the last seen (source, mtime, size) and the
+    sha1 of the content last written are kept: a file is only rendered
+    again when its source changed, and only written when the result differs
+    from what was last written.
+    """
+
+    def __init__(self, sourcename, destname, servicename=None, jobs=1):
+        self.sourcename = sourcename
+        self.destname = destname
+        self.servicename = servicename
+        self.destpath = os.path.join(OUTPUT, destname)
+        self.plan = make_plan(sourcename, destname, servicename)
+        self.jobs = jobs
+        self.signatures = {}
+        self.hashes = {}
+        self.template = None
+
+    def roots(self):
+        "Returns the folders to watch (the template and its layers)."
+        return self.template.layers + [self.template.path]
+
+    def _file_state(self, entry):
+        "Returns (signature, sha1 of the rendered content) for a file entry."
+        sourcerel, _, _, source = entry
+        stat = os.stat(source)
+        content, _ = render_file(entry, self.plan, self.template.index)
+        if content is None:
+            sha1 = self.template.index.files[
+                sourcerel.replace(os.sep, "/")]["sha1"]
+        else:
+            sha1 = hashlib.sha1(content).hexdigest()
+        return (source, stat.st_mtime, stat.st_size), sha1
+
+    def start(self):
+        "Generates (or adds to) the project, and records its state."
+        self.template = Template(self.sourcename, self.jobs)
+        generate(self.sourcename, self.destname, self.servicename, self.jobs,
+                 self.template)
+        print
+        _, files = self.template.plan(self.plan)
+        for entry in files:
+            try:
+                self.signatures[entry[1]], self.hashes[entry[1]] = \
+                    self._file_state(entry)
+            except (IOError, OSError):
+                pass # Vanished meanwhile: picked up by the next sync if back
+
+    def sync(self):
+        """Re-applies the template files that changed since the last sync.
+
+        Returns the relative paths of the files written. Files that vanish
+        meanwhile (i.e. an editor's temporary files) are skipped; they will
+        be looked at again on the next sync.
+        """
+        try:
+            self.template = Template(self.sourcename, self.jobs)
+        except (IOError, OSError):
+            return [] # A file vanished while the template was being listed
+        folders, files = self.template.plan(self.plan)
+        for _, destrel in folders:
+            folder = os.path.join(self.destpath, destrel)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        written = []
+        for entry in files:
+            destrel = entry[1]
+            try:
+                stat = os.stat(entry[3])
+                if self.signatures.get(destrel) == \
+                        (entry[3], stat.st_mtime, stat.st_size):
+                    continue
+                signature, sha1 = self._file_state(entry)
+                if self.hashes.get(destrel) != sha1:
+                    write_file(self.destpath, entry, self.plan,
+                               self.template.index)
+            except (IOError, OSError):
+                continue
+            self.signatures[destrel] = signature
+            if self.hashes.get(destrel) == sha1:
+                continue # Touched, but the output doesn't change.
+            self.hashes[destrel] = sha1
+            written.append(destrel)
+        return written
+
+
+def change_waiter(paths, interval=1.0, poll=False):
+    """Returns a function blocking until something changes in the paths.
+
+    Uses inotify through pyinotify if it is installed (and poll isn't set),
+    else just waits for interval seconds. The returned function takes the
+    (possibly changed) list of paths to watch.
+    """
+    try:
+        if poll:
+            raise ImportError
+        import pyinotify
+    except ImportError:
+        return lambda paths: time.sleep(interval)
+    manager = pyinotify.WatchManager()
+    mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE \
+        | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM \
+        | pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB
+    notifier = pyinotify.Notifier(manager, default_proc_fun=lambda event: None)
+    watched = set()
+
+    def wait(paths):
+        for path in paths:
+            if path not in watched:
+                manager.add_watch(path, mask, rec=True, auto_add=True)
+                watched.add(path)
+        if notifier.check_events(timeout=None):
+            # Let a burst of events (i.e. an editor saving) settle down
+            while True:
+                notifier.read_events()
+                notifier.process_events()
+                if not notifier.check_events(timeout=100):
+                    break
+    return wait
+
+def watch(sourcename, destname, servicename=None, jobs=1, interval=1.0,
+          poll=False):
+    """Generate a project, then keep re-applying template changes to it.
+
+    Only changed template files are rendered again, and only those whose
+    result changed are written (see TemplateSync). Runs until interrupted.
+    """
+    sync = TemplateSync(sourcename, destname, servicename, jobs)
+    sync.start()
+    wait = change_waiter(sync.roots(), interval, poll)
+    print "Watching", sourcename, "for", destname, "(Ctrl+C to stop)"
+    try:
+        while True:
+            wait(sync.roots())
+            for destrel in sync.sync():
+                print "Updated", destrel
+    except KeyboardInterrupt:
+        print "Stopped watching", sourcename
+
 def test_run():
     #generate("pythonapp", "mytestapp")
     generate("service-tabletpage", "servicetestapp", "ALSuperDuperService")
 
 # Used for argcomplete
 class TemplateCompleter(object):
-    def __init__(self):
-        self.choices = os.listdir("templates")
-
     def __call__(self, prefix, **kwargs):
-        return (c for c in self.choices if c.startswith(prefix))
+        # Completers can give descriptions (shown by zsh and fish); they are
+        # taken from the registry as it is, as indexing templates would make
+        # completion slow
+        templates = Registry.load().templates
+        return dict((name, templates.get(name, {}).get("description", ""))
+                    for name in template_names() if name.startswith(prefix))
+
+
+def list_templates():
+    "Prints the available templates, from the registry."
+    for entry in Registry.load().refresh():
+        print "%-22s %4d files %7.1f KB  %s" % (
+            entry["name"], entry["files"], entry["size"] / 1024.0,
+            entry["description"])
+
+
+def add_instrumentation_args(parser):
+    "Adds the --stats and --profile options to an argument parser."
+    parser.add_argument('--stats', action='store_true',
+                       help='print files and bytes processed, and time spent '
+                       'per phase')
+    parser.add_argument('--profile', type=str, metavar='FILE',
+                       help='dump cProfile statistics of the run to FILE '
+                       '(read them with pstats)')
+
+def run_instrumented(args, function, *fargs, **fkwargs):
+    """Calls function, with the instrumentation asked for on the command line.
+
+    The profile covers the worker threads of map_jobs and imap_jobs too,
+    merged with the main thread's.
+    """
+    global _thread_profilers
+    STATS.reset()
+    try:
+        if args.profile:
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            _thread_profilers = []
+            try:
+                return profiler.runcall(function, *fargs, **fkwargs)
+            finally:
+                stats = pstats.Stats(profiler)
+                for thread_profiler in _thread_profilers:
+                    stats.add(thread_profiler)
+                _thread_profilers = None
+                stats.dump_stats(args.profile)
+        return function(*fargs, **fkwargs)
+    finally:
+        if args.stats:
+            print
+            print STATS.report()
 
+def add_cache_args(parser):
+    "Adds the --cache options to a parser."
+    parser.add_argument('--cache', action='store_true',
+                       help='restore new projects from a cache of previous '
+                       'generations (in $JUMPSTART_CACHE, default '
+                       '~/.cache/jumpstart), or add them to it')
+    parser.add_argument('--cache-budget', type=int,
+                       default=CACHE_BUDGET / (1024 * 1024), metavar='MB',
+                       help='disk space of the cache; least recently used '
+                       'projects are removed beyond it (default: %(default)s)')
+
+def cache_from_args(args):
+    "Returns the OutputCache asked for by add_cache_args options, if any."
+    if args.cache:
+        return OutputCache(budget=args.cache_budget * 1024 * 1024)
+
+def run_batch_with_args(args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='jumpstart.py batch',
+        description='Generates all the projects listed in a JSON file.')
+    parser.add_argument('planfile', type=str,
+                       help='JSON list of [template, destname, servicename]')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                       help='number of projects to generate in parallel')
+    parser.add_argument('--link', action='store_true',
+                       help='link files that need no rewriting, see -h')
+    add_cache_args(parser)
+    add_instrumentation_args(parser)
+    args = parser.parse_args(args)
+    if run_instrumented(args, generate_batch, args.planfile, args.jobs,
+                        args.link, cache_from_args(args)):
+        sys.exit(1)
+
+def run_watch_with_args(args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='jumpstart.py watch',
+        description='Generates a project, then keeps applying the changes '
+        'made to its template.')
+    parser.add_argument('sourcename', type=str,
+                       help='name of source recipe/template').completer = TemplateCompleter()
+    parser.add_argument('destname', type=str,
+                       help='name of project to keep in sync')
+    parser.add_argument('servicename', type=str,
+                       help='optional, name of service to create',
+                       nargs='?')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                       help='number of files to read in parallel')
+    parser.add_argument('--interval', type=float, default=1.0,
+                       help='seconds between checks, when polling')
+    parser.add_argument('--poll', action='store_true',
+                       help='poll for changes, even if pyinotify is installed')
+    args = parser.parse_args(args)
+    watch(args.sourcename, args.destname, args.servicename, args.jobs,
+          args.interval, args.poll)
 
 def run_with_sysargs():
+    if sys.argv[1:2] == ["batch"]:
+        return run_batch_with_args(sys.argv[2:])
+    if sys.argv[1:2] == ["watch"]:
+        return run_watch_with_args(sys.argv[2:])
+    if sys.argv[1:] == ["list"]:
+        return list_templates()
     import argparse
-    parser = argparse.ArgumentParser(description='Generates a project.')
+    parser = argparse.ArgumentParser(description='Generates a project.',
+                                     epilog='To list the templates, run '
+                                     '"jumpstart.py list". To generate several '
+                                     'projects at once, see "jumpstart.py '
+                                     'batch -h"; to keep a project in sync '
+                                     'with its template, "jumpstart.py watch '
+                                     '-h".')
     parser.add_argument('sourcename', type=str,
                        help='name of source recipe/template').completer = TemplateCompleter()
     parser.add_argument('destname', type=str,
@@ -125,16 +1467,32 @@ def run_with_sysargs():
     parser.add_argument('servicename', type=str,
                        help='optional, name of service to create',
                        nargs='?')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                       help='number of files to write in parallel')
+    parser.add_argument('--link', action='store_true',
+                       help='reflink files that need no rewriting instead of '
+                       'copying them, or hardlink binary ones (icons...); do '
+                       'not edit hardlinked files in place, it would change '
+                       'the template too')
+    parser.add_argument('--pkg', action='store_true',
+                       help='write the app straight into output/DESTNAME.pkg, '
+                       'instead of generating a project folder')
+    add_cache_args(parser)
+    add_instrumentation_args(parser)
     if argcomplete:
         argcomplete.autocomplete(parser)
     args = parser.parse_args()
-    if (args.servicename):
-        generate(args.sourcename, args.destname, args.servicename)
+    if args.pkg:
+        run_instrumented(args, generate_package, args.sourcename,
+                         args.destname, args.servicename, args.jobs)
     else:
-        generate(args.sourcename, args.destname)
+        run_instrumented(args, generate, args.sourcename, args.destname,
+                         args.servicename, args.jobs, link=args.link,
+                         cache=cache_from_args(args))
 
 if __name__ == "__main__":
     #test_run()
-    #rename_in_folder("./output/basicparams/", "basicparams", "volumeslider")
+    #rename_in_folder("./output/basicparams/",
+    #                 SubstitutionPlan([("basicparams", "volumeslider")]))
     run_with_sysargs()
 
@@ -0,0 +1,200 @@
+"""
+stk.aioevents.py
+
+Bridges stk.events (and qi futures) to asyncio, so that many events can be
+waited for on a single event loop instead of blocking a thread for each.
+
+Written without async/await, so it can be imported with trollius on Python 2.
+"""
+
+__version__ = "0.1.1"
+
+__copyright__ = "Copyright 2015, Aldebaran Robotics"
+__author__ = 'ekroeger'
+__email__ = 'ekroeger@aldebaran.com'
+
+from collections import deque
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+try:
+    StopAsyncIteration
+except NameError:  # Python < 3.5
+    class StopAsyncIteration(Exception):
+        "Raised by EventStream once it's closed."
+
+
+def to_asyncio(future, loop=None):
+    """Returns an asyncio future with the result of a qi future.
+
+    Cancelling the asyncio future cancels the qi one.
+    """
+    loop = loop or asyncio.get_event_loop()
+    result = loop.create_future() if hasattr(loop, "create_future") \
+        else asyncio.Future(loop=loop)
+
+    def transfer(future):
+        "Runs in the loop - copies the outcome of the qi future."
+        if result.done():
+            return
+        if future.isCanceled():
+            result.cancel()
+        elif future.hasError():
+            result.set_exception(RuntimeError(future.error()))
+        else:
+            result.set_result(future.value())
+
+    def on_done(future):
+        "Runs in a qi thread."
+        try:
+            loop.call_soon_threadsafe(transfer, future)
+        except RuntimeError:
+            pass  # The loop was closed
+
+    def on_cancel(result):
+        if result.cancelled():
+            future.cancel()
+    result.add_done_callback(on_cancel)
+    future.addCallback(on_done)
+    return result
+
+
+class EventStream(object):
+    """The values of an event, as an asynchronous iterator.
+
+    Usage (Python 3.5+):
+
+    async for value in aio_events.stream("MyMemoryKey"):
+        print(value)
+
+    Values raised faster than they are consumed are buffered; with maxsize,
+    only the most recent ones are kept.
+    """
+
+    def __init__(self, aio_events, event, maxsize=0):
+        self.aio_events = aio_events
+        self.event = event
+        self.values = deque(maxlen=maxsize or None)
+        self.waiter = None
+        self.closed = False
+
+    def _push(self, value):
+        "Internal - called in the loop for each value."
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_result(value)
+            self.waiter = None
+        else:
+            self.values.append(value)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        "Returns a future of the next value."
+        future = self.aio_events._future()
+        if self.values:
+            future.set_result(self.values.popleft())
+        elif self.closed:
+            future.set_exception(StopAsyncIteration())
+        else:
+            self.waiter = future
+        return future
+
+    def close(self):
+        "Stops the stream (ending an iteration over it)."
+        if self.closed:
+            return
+        self.closed = True
+        self.aio_events._remove(self.event, self)
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_exception(StopAsyncIteration())
+        self.waiter = None
+
+
+class AsyncEvents(object):
+    """asyncio version of an EventHelper's waits.
+
+    Usage (Python 3.5+):
+
+    aio_events = AsyncEvents(events)
+    value = await aio_events.next("FrontTactilTouched")
+
+    Each event is only connected once (through the EventHelper) however
+    many futures and streams use it, and disconnected when none is left.
+    Must be used from the thread running the loop.
+    """
+
+    def __init__(self, events, loop=None):
+        self.events = events
+        self.loop = loop or asyncio.get_event_loop()
+        self.connections = {}  # event -> connection id
+        self.waiters = {}  # event -> futures and streams
+
+    def _future(self):
+        "Internal - a new future, on our loop."
+        if hasattr(self.loop, "create_future"):
+            return self.loop.create_future()
+        return asyncio.Future(loop=self.loop)
+
+    def _add(self, event, waiter):
+        "Internal - registers a future or stream, connecting if needed."
+        self.waiters.setdefault(event, []).append(waiter)
+        if event not in self.connections:
+            if "." in event:  # it's a signal
+                callback = lambda *args: self._on_event(event, args)
+            else:
+                callback = lambda value: self._on_event(event, value)
+            self.connections[event] = self.events.connect(event, callback)
+
+    def _remove(self, event, waiter):
+        "Internal - unregisters a future or stream, disconnecting if needed."
+        waiters = self.waiters.get(event, [])
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters and event in self.connections:
+            del self.waiters[event]
+            self.events.disconnect(event, self.connections.pop(event))
+
+    def _on_event(self, event, value):
+        "Internal - callback, in a qi thread."
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, event, value)
+        except RuntimeError:
+            pass  # The loop was closed
+
+    def _deliver(self, event, value):
+        "Internal - passes a value to the waiters, in the loop."
+        for waiter in list(self.waiters.get(event, [])):
+            if isinstance(waiter, EventStream):
+                waiter._push(value)
+            else:
+                if not waiter.done():
+                    waiter.set_result(value)
+                self._remove(event, waiter)
+
+    def next(self, event):
+        "Returns a future of the next value of an event (or signal's args)."
+        future = self._future()
+        self._add(event, future)
+        future.add_done_callback(
+            lambda future: future.cancelled() and self._remove(event, future))
+        return future
+
+    def stream(self, event, maxsize=0):
+        "Returns an EventStream of the values of an event (see EventStream)."
+        stream = EventStream(self, event, maxsize)
+        self._add(event, stream)
+        return stream
+
+    def close(self):
+        "Cancels all the futures and closes all streams."
+        for event, waiters in list(self.waiters.items()):
+            for waiter in list(waiters):
+                if isinstance(waiter, EventStream):
+                    waiter.close()
+                else:
+                    waiter.cancel()
+                    self._remove(event, waiter)
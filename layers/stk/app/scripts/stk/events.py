@@ -0,0 +1,1257 @@
+"""
+stk.events.py
+
+Provides misc. wrappers for ALMemory and Signals (using the same syntax for
+handling both).
+"""
+
+__version__ = "0.1.1"
+
+__copyright__ = "Copyright 2015, Aldebaran Robotics"
+__author__ = 'ekroeger'
+__email__ = 'ekroeger@aldebaran.com'
+
+import array
+import bisect
+import inspect
+import itertools
+import marshal
+import struct
+import threading
+import time
+import traceback
+import weakref
+from collections import OrderedDict, deque
+
+import qi
+
+
+def on(*keys, **policies):
+    """Decorator for connecting a callback to one or several events.
+
+    Usage:
+
+    class O:
+        @on("MyMemoryKey")
+        def my_callback(self,value):
+            print "I was called!", value
+
+    o = O()
+    events = EventsHelper()
+    events.connect_decorators(o)
+
+    After that, whenever MyMemoryKey is raised, o.my_callback will be called
+    with the value.
+
+    For events raised at a high rate, policies limiting the calls can be
+    given, i.e. @on("MyMemoryKey", throttle=0.05, distinct=True); see
+    CallbackPolicy.
+    """
+    for name in policies:
+        if name not in CallbackPolicy.OPTIONS:
+            raise TypeError("on() got an unexpected keyword argument %r"
+                            % name)
+
+    def decorator(func):
+        func.__event_keys__ = keys
+        func.__event_policies__ = policies
+        return func
+    return decorator
+
+
+# Class -> its decorated methods, see event_table
+_EVENT_TABLES = weakref.WeakKeyDictionary()
+
+
+def event_table(cls):
+    """Returns the methods of a class decorated with @on, as (descriptor,
+    keys, policies) tuples.
+
+    Only the class dicts along the MRO are looked at (so no property or
+    other attribute is evaluated), and a method overridden without @on in a
+    subclass isn't connected. Computed once per class.
+    """
+    table = _EVENT_TABLES.get(cls)
+    if table is None:
+        table = []
+        seen = set()
+        for klass in inspect.getmro(cls):
+            for name, descriptor in vars(klass).items():
+                if name in seen:
+                    continue
+                seen.add(name)
+                func = getattr(descriptor, "__func__", descriptor)
+                if hasattr(func, "__event_keys__"):
+                    table.append((descriptor, func.__event_keys__,
+                                  getattr(func, "__event_policies__", {})))
+        _EVENT_TABLES[cls] = table
+    return table
+
+
+class CallbackPolicy(object):
+    """Wraps a callback, to limit how often events call it.
+
+    * distinct=True: skips events with the same value as the previous one.
+    * throttle=seconds: calls at most once per period; the last event
+      skipped during a period is delivered at its end.
+    * debounce=seconds: waits for the events to stop for that long, then
+      calls with the last one.
+    * latest_only=True: never runs the callback concurrently; events raised
+      while it runs are collapsed into one call, with the last of them.
+
+    Skipped events only cost a comparison or two under a lock.
+    """
+    OPTIONS = ("throttle", "debounce", "latest_only", "distinct")
+
+    def __init__(self, callback, throttle=None, debounce=None,
+                 latest_only=False, distinct=False):
+        self.callback = callback
+        self.throttle = throttle
+        self.debounce = debounce
+        self.latest_only = latest_only
+        self.distinct = distinct
+        self.lock = threading.Lock()
+        self.previous = None  # (args,) of the previous event, for distinct
+        self.pending = None  # args waiting for the timer
+        self.timer = None
+        self.last_call = 0  # for throttle
+        self.last_event = 0  # for debounce
+        self.running = False  # for latest_only
+        self.queued = None  # args waiting for the running call to finish
+        self.cancelled = False
+
+    def __call__(self, *args):
+        with self.lock:
+            if self.cancelled:
+                return
+            if self.distinct:
+                if self.previous == (args,):
+                    return
+                self.previous = (args,)
+            if self.debounce:
+                self.pending = args
+                self.last_event = time.time()
+                if not self.timer:
+                    self._schedule(self.debounce)
+                return
+            if self.throttle:
+                now = time.time()
+                if self.timer or now < self.last_call + self.throttle:
+                    self.pending = args
+                    if not self.timer:
+                        self._schedule(self.last_call + self.throttle - now)
+                    return
+                self.last_call = now
+        self._run(args)
+
+    def _schedule(self, delay):
+        "Internal - starts the timer (called with the lock held)."
+        self.timer = threading.Timer(delay, self._on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _on_timer(self):
+        "Internal - delivers the pending event, when it's time."
+        with self.lock:
+            self.timer = None
+            if self.cancelled:
+                return
+            if self.debounce:
+                remaining = self.last_event + self.debounce - time.time()
+                if remaining > 0:
+                    # Events came in meanwhile: wait some more
+                    self._schedule(remaining)
+                    return
+            args, self.pending = self.pending, None
+            if args is None:
+                return
+            self.last_call = time.time()
+        self._run(args)
+
+    def _run(self, args):
+        "Internal - calls the callback (once at a time, with latest_only)."
+        if not self.latest_only:
+            return self.callback(*args)
+        with self.lock:
+            if self.running:
+                self.queued = args
+                return
+            self.running = True
+        try:
+            while args is not None:
+                self.callback(*args)
+                with self.lock:
+                    args, self.queued = self.queued, None
+        finally:
+            with self.lock:
+                self.running = False
+
+    def cancel(self):
+        """Drops the pending and queued events, and ignores any later one
+        (called when the callback is disconnected)."""
+        with self.lock:
+            self.cancelled = True
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.pending = self.queued = None
+
+
+class RingBuffer(object):
+    """The last (timestamp, value) pairs of a numeric key (see track()).
+
+    Values are stored in fixed-size arrays of doubles, so appending is O(1)
+    and allocates nothing. Queries take an optional window, in seconds: only
+    values from the last window seconds are then considered. They return
+    None when there are no values (or not enough, for rate).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array.array("d", [0.0]) * capacity
+        self.values = array.array("d", [0.0]) * capacity
+        self.next = 0  # index of the next value to write
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value, timestamp=None):
+        "Adds a value (the oldest one is dropped when full)."
+        with self.lock:
+            self.times[self.next] = timestamp or time.time()
+            self.values[self.next] = value
+            self.next = (self.next + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+
+    def _ranges(self, window):
+        "Internal - index ranges of the values in the window, oldest first."
+        if self.count < self.capacity:
+            ranges = [(0, self.count)]
+        else:
+            ranges = [(self.next, self.capacity), (0, self.next)]
+        start = None if window is None else time.time() - window
+        result = []
+        for low, high in ranges:
+            if start is not None:
+                low = bisect.bisect_left(self.times, start, low, high)
+            if low < high:
+                result.append((low, high))
+        return result
+
+    def window(self, window=None):
+        "Returns (timestamps, values) arrays, oldest first."
+        times = array.array("d")
+        values = array.array("d")
+        with self.lock:
+            for low, high in self._ranges(window):
+                times.extend(self.times[low:high])
+                values.extend(self.values[low:high])
+        return times, values
+
+    def last(self):
+        "Returns the last (timestamp, value), or None."
+        with self.lock:
+            if not self.count:
+                return None
+            index = (self.next - 1) % self.capacity
+            return self.times[index], self.values[index]
+
+    def mean(self, window=None):
+        "Mean of the values."
+        values = self.window(window)[1]
+        return sum(values) / len(values) if values else None
+
+    def min(self, window=None):
+        "Minimum of the values."
+        values = self.window(window)[1]
+        return min(values) if values else None
+
+    def max(self, window=None):
+        "Maximum of the values."
+        values = self.window(window)[1]
+        return max(values) if values else None
+
+    def rate(self, window=None):
+        "Change of the value per second, from the first to the last value."
+        times, values = self.window(window)
+        if len(values) < 2 or times[-1] == times[0]:
+            return None
+        return (values[-1] - values[0]) / (times[-1] - times[0])
+
+    def percentile(self, percent, window=None):
+        "Percentile of the values (interpolated, i.e. 50 is the median)."
+        values = sorted(self.window(window)[1])
+        if not values:
+            return None
+        position = (len(values) - 1) * percent / 100.0
+        low = int(position)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class WaitTimeout(RuntimeError):
+    "Raised by EventHelper.wait_for (and co.) when their timeout expires."
+
+
+def _cast(function, value, default):
+    "Returns function(value), or default if value can't be converted."
+    try:
+        return function(value)
+    except (ValueError, TypeError):
+        return default
+
+
+class CallbackExecutor(object):
+    """Runs event callbacks on its own threads, from a bounded queue.
+
+    Usage:
+
+    executor = CallbackExecutor(workers=2, queue_size=50,
+                                overflow=CallbackExecutor.DROP_OLDEST)
+    events = EventHelper(session, executor=executor)
+
+    Callbacks connected by that helper then don't run on libqi's threads, so
+    a slow one doesn't hold up other deliveries (their distinct, throttle and
+    debounce policies are still applied before queueing). When the queue is
+    full, an event either replaces the oldest queued one (DROP_OLDEST), is
+    dropped (DROP_NEWEST), or blocks the thread delivering it until there is
+    room (BLOCK). stats() tells how the queue copes with the load.
+    """
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    BLOCK = "block"
+
+    def __init__(self, workers=1, queue_size=100, overflow=DROP_OLDEST):
+        if overflow not in (self.DROP_OLDEST, self.DROP_NEWEST, self.BLOCK):
+            raise ValueError("Unknown overflow policy: %r" % overflow)
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.queue = deque()  # (time queued, callback, args)
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.stopped = False
+        self.counts = dict.fromkeys(("submitted", "executed", "dropped",
+                                     "cancelled", "errors", "max_depth"), 0)
+        self.times = dict.fromkeys(("wait_total", "wait_max", "run_total",
+                                    "run_max"), 0.0)
+        self.threads = [threading.Thread(target=self._work)
+                        for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def wrap(self, callback):
+        """Returns a callback queueing calls to the given one; its cancel()
+        skips the calls still queued, and any later one."""
+        return QueuedCallback(self, callback)
+
+    def submit(self, callback, args=()):
+        "Queues a call; returns False if it was dropped."
+        with self.lock:
+            if self.stopped:
+                return False
+            while len(self.queue) >= self.queue_size:
+                self.counts["dropped"] += self.overflow != self.BLOCK
+                if self.overflow == self.DROP_NEWEST:
+                    return False
+                elif self.overflow == self.DROP_OLDEST:
+                    self.queue.popleft()
+                else:
+                    self.not_full.wait()
+                    if self.stopped:
+                        return False
+            self.queue.append((time.time(), callback, args))
+            self.counts["submitted"] += 1
+            self.counts["max_depth"] = max(self.counts["max_depth"],
+                                           len(self.queue))
+            self.not_empty.notify()
+            return True
+
+    def _discard(self, callback):
+        "Internal - drops the queued calls of a callback."
+        with self.lock:
+            depth = len(self.queue)
+            self.queue = deque(item for item in self.queue
+                               if item[1] != callback)
+            self.counts["cancelled"] += depth - len(self.queue)
+            self.not_full.notify_all()
+
+    def _work(self):
+        "Internal - a worker thread."
+        while True:
+            with self.lock:
+                while not self.queue and not self.stopped:
+                    self.not_empty.wait()
+                if not self.queue:
+                    return
+                queued, callback, args = self.queue.popleft()
+                self.not_full.notify()
+            start = time.time()
+            try:
+                callback(*args)
+                failed = False
+            except Exception:
+                traceback.print_exc()
+                failed = True
+            end = time.time()
+            with self.lock:
+                self.counts["executed"] += 1
+                self.counts["errors"] += failed
+                self.times["wait_total"] += start - queued
+                self.times["wait_max"] = max(self.times["wait_max"],
+                                             start - queued)
+                self.times["run_total"] += end - start
+                self.times["run_max"] = max(self.times["run_max"], end - start)
+
+    def stats(self):
+        """Returns a dict of metrics: calls submitted, executed, dropped,
+        cancelled and failed, current and max queue depth, and the mean and max time calls
+        waited in the queue and ran (in seconds)."""
+        with self.lock:
+            stats = dict(self.counts)
+            stats["depth"] = len(self.queue)
+            executed = max(self.counts["executed"], 1)
+            stats["wait_mean"] = self.times["wait_total"] / executed
+            stats["wait_max"] = self.times["wait_max"]
+            stats["run_mean"] = self.times["run_total"] / executed
+            stats["run_max"] = self.times["run_max"]
+            return stats
+
+    def shutdown(self, wait=True):
+        "Stops accepting calls; the queued ones are still run."
+        with self.lock:
+            self.stopped = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+
+class QueuedCallback(object):
+    "A callback run by a CallbackExecutor (see CallbackExecutor.wrap)."
+
+    def __init__(self, executor, callback):
+        self.executor = executor
+        self.callback = callback
+        self.cancelled = False
+
+    def __call__(self, *args):
+        if not self.cancelled:
+            self.executor.submit(self._run, args)
+
+    def _run(self, *args):
+        "Internal - runs in a worker thread."
+        if not self.cancelled:
+            self.callback(*args)
+
+    def cancel(self):
+        "Skips the queued calls, and ignores any later one."
+        self.cancelled = True
+        self.executor._discard(self._run)
+
+
+_DISPATCHING = threading.local()  # .active in SharedSignal callbacks
+
+
+class SharedSignal(object):
+    """One ALMemory subscriber, shared by all the EventHelpers of a process.
+
+    Has the connect / disconnect interface of a signal; the remote subscriber
+    only exists while there are connections, and each event it delivers is
+    passed on to all of them.
+    """
+
+    def __init__(self, registry, key, session, almemory, event):
+        self.registry = registry
+        self.key = key
+        self.session = session  # So its id isn't reused while in the registry
+        self.almemory = almemory
+        self.event = event
+        self.subscriber = None
+        self.subscriber_connection = None
+        self.updating = False  # see _update_subscriber
+        self.updated = threading.Condition(registry.lock)
+        self.callbacks = {}
+        self.targets = ()  # snapshot of the callbacks, for dispatching
+
+    def _dispatch(self, *args):
+        "Internal - callback of the remote subscriber."
+        dispatching = getattr(_DISPATCHING, "active", False)
+        _DISPATCHING.active = True
+        try:
+            for callback in self.targets:
+                try:
+                    callback(*args)
+                except Exception:
+                    # Don't deprive the other callbacks of the event
+                    traceback.print_exc()
+        finally:
+            _DISPATCHING.active = dispatching
+
+    def connect(self, callback):
+        "Connects a callback; returns a connection id."
+        with self.registry.lock:
+            # (Re-)register, in case it was dropped meanwhile
+            self.registry.signals.setdefault(self.key, self)
+            connection_id = next(self.registry.connection_ids)
+            self.callbacks[connection_id] = callback
+            self.targets = tuple(self.callbacks.values())
+        try:
+            self._update_subscriber()
+        except Exception:
+            self._remove(connection_id)
+            raise
+        return connection_id
+
+    def disconnect(self, connection_id):
+        "Disconnects a callback; the last one drops the remote subscriber."
+        if not self._remove(connection_id):
+            return False
+        self._update_subscriber()
+        return True
+
+    def _remove(self, connection_id):
+        "Internal - removes a callback; returns whether it was there."
+        with self.registry.lock:
+            if self.callbacks.pop(connection_id, None) is None:
+                return False
+            self.targets = tuple(self.callbacks.values())
+            registered = self.registry.signals.get(self.key) is self
+            if not self.callbacks and registered:
+                del self.registry.signals[self.key]
+            return True
+
+    def _update_subscriber(self):
+        """Internal - creates or drops the remote subscriber, so that it
+        exists if and only if there are callbacks.
+
+        No lock is held during the remote calls: libqi's disconnect waits for
+        running callbacks, which may themselves connect or disconnect. If
+        another thread is already updating, we wait for it (and retry if it
+        failed), except from a callback, which that thread may be waiting
+        for: it then takes care of our changes.
+        """
+        lock = self.registry.lock
+        with lock:
+            while self.updating:
+                if getattr(_DISPATCHING, "active", False):
+                    return
+                self.updated.wait()
+            self.updating = True
+        try:
+            while True:
+                with lock:
+                    if bool(self.callbacks) == (self.subscriber is not None):
+                        self.updating = False
+                        self.updated.notify_all()
+                        return
+                    subscriber = self.subscriber
+                    connection = self.subscriber_connection
+                    self.subscriber = self.subscriber_connection = None
+                if subscriber is None:
+                    subscriber = self.almemory.subscriber(self.event)
+                    connection = subscriber.signal.connect(self._dispatch)
+                    with lock:
+                        self.subscriber = subscriber
+                        self.subscriber_connection = connection
+                else:
+                    subscriber.signal.disconnect(connection)
+        except Exception:
+            # Left without subscriber: the waiting threads (or the next
+            # connect) try again
+            with lock:
+                self.updating = False
+                self.updated.notify_all()
+            raise
+
+
+class SubscriberRegistry(object):
+    """The ALMemory subscribers of the process (see SharedSignal).
+
+    N helpers listening to the same key in the same session cost a single
+    remote subscription, and a single delivery of each event.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.signals = {}  # (session id, event) -> SharedSignal
+        self.connection_ids = itertools.count(1)
+
+    def signal(self, session, almemory, event):
+        "Returns the SharedSignal of an ALMemory event."
+        key = (id(session), event)
+        with self.lock:
+            if key not in self.signals:
+                self.signals[key] = SharedSignal(self, key, session, almemory,
+                                                 event)
+            return self.signals[key]
+
+SUBSCRIBERS = SubscriberRegistry()
+
+
+class EventHelper(object):
+    "Helper for ALMemory; takes care of event connections so you don't have to"
+
+    def __init__(self, session=None, executor=None):
+        self.session = None
+        self.almemory = None
+        if session:
+            self.init(session)
+        self.executor = executor  # a CallbackExecutor, if any
+        self.recorder = None  # an EventRecorder, if recording
+        self.record_connections = {}  # event -> connection of the recorder
+        self.tracks = {}  # key -> (RingBuffer, connection id), see track()
+        # a handler is (subscriber, {connection id: what to cancel when it's
+        # disconnected, i.e. CallbackPolicies and QueuedCallbacks})
+        self.handlers = {}
+        self.subscriber_names = {}
+        self.waits = {}  # event -> waits in progress, see _start_wait
+        self.wait_connections = {}  # event -> connection kept for waits
+        self.wait_subscriptions = {}  # event -> number of subscribe waits
+        self.wait_lock = threading.Lock()
+        self.wait_connect_lock = threading.Lock()
+
+    def init(self, session):
+        "Sets the NAOqi session, if it wasn't passed to the constructor"
+        self.session = session
+        self.almemory = session.service("ALMemory")
+
+    def connect_decorators(self, obj):
+        "Connects all decorated methods of target object."
+        cls = obj.__class__
+        for descriptor, keys, policies in event_table(cls):
+            member = descriptor.__get__(obj, cls)
+            for event in keys:
+                self.connect(event, member, **policies)
+
+    def connect(self, event, callback, **policies):
+        """Connects an ALMemory event or signal to a callback.
+
+        Note that some events trigger side effects in services when someone
+        subscribes to them (such as WordRecognized). Those will *not* be
+        triggered by this function, for those, use .subscribe().
+
+        Policies limiting the calls (throttle, debounce...) can be given,
+        see CallbackPolicy. If the helper has an executor, the callback is run
+        by it; only the events the policies let through are queued.
+        """
+        cancellables = []
+        if self.executor:
+            if policies.pop("latest_only", False):
+                # That one is about the runs, so it goes on the worker side
+                callback = CallbackPolicy(callback, latest_only=True)
+                cancellables.append(callback)
+            callback = self.executor.wrap(callback)
+            cancellables.append(callback)
+        if policies:
+            callback = CallbackPolicy(callback, **policies)
+            cancellables.append(callback)
+        if event not in self.handlers:
+            if "." in event:
+                # if we have more than one ".":
+                service_name, signal_name = event.split(".")
+                service = self.session.service(service_name)
+                self.handlers[event] = (getattr(service, signal_name), {})
+            else:
+                # It's a "normal" ALMemory event; its subscriber is shared
+                self.handlers[event] = (SUBSCRIBERS.signal(
+                    self.session, self.almemory, event), {})
+        signal, connections = self.handlers[event]
+        connection_id = signal.connect(callback)
+        # Cancelled from the outside in, so nothing gets queued meanwhile
+        connections[connection_id] = cancellables[::-1]
+        if self.recorder and event not in self.record_connections:
+            self._connect_recorder(event)
+        return connection_id
+
+    def _connect_recorder(self, event):
+        "Internal - connects the recorder to an event."
+        recorder = self.recorder
+        signal, connections = self.handlers[event]
+        connection_id = signal.connect(
+            lambda *args: recorder.record(event, args))
+        connections[connection_id] = []
+        self.record_connections[event] = connection_id
+
+    def start_recording(self, recorder):
+        """Records all events delivered to this helper's callbacks in an
+        EventRecorder, until stop_recording()."""
+        self.stop_recording()
+        self.recorder = recorder
+        for event in list(self.handlers):
+            self._connect_recorder(event)
+
+    def stop_recording(self):
+        "Stops recording events (doesn't close the recorder)."
+        self.recorder = None
+        for event, connection_id in list(self.record_connections.items()):
+            self.disconnect(event, connection_id)
+        self.record_connections.clear()
+
+    def subscribe(self, event, attachedname, callback):
+        """Subscribes to an ALMemory event so as to notify providers.
+
+        This is necessary for things like WordRecognized."""
+        connection_id = self.connect(event, callback)
+        dummyname = "on_" + event.replace("/", "")
+        self.almemory.subscribeToEvent(event, attachedname, dummyname)
+        self.subscriber_names[event] = attachedname
+        return connection_id
+
+    def disconnect(self, event, connection_id=None):
+        "Disconnects a connection, or all if no connection is specified."
+        if event in self.handlers:
+            signal, connections = self.handlers[event]
+            if connection_id:
+                if connection_id in connections:
+                    signal.disconnect(connection_id)
+                    # So that no pending or queued call runs after this
+                    for cancellable in connections.pop(connection_id):
+                        cancellable.cancel()
+            else:
+                # Didn't specify a connection ID: remove all
+                for connection_id, cancellables in connections.items():
+                    signal.disconnect(connection_id)
+                    for cancellable in cancellables:
+                        cancellable.cancel()
+                connections.clear()
+            if not connections:
+                # Drop the subscriber, so ALMemory stops sending the event
+                del self.handlers[event]
+            if self.wait_connections.get(event) not in connections:
+                self.wait_connections.pop(event, None)
+            if self.record_connections.get(event) not in connections:
+                self.record_connections.pop(event, None)
+            if self.tracks.get(event, (None, None))[1] not in connections:
+                self.tracks.pop(event, None)
+            if event in self.subscriber_names:
+                name = self.subscriber_names[event]
+                self.almemory.unsubscribeToEvent(event, name)
+                del self.subscriber_names[event]
+
+    def clear(self):
+        "Disconnect all connections"
+        for event in list(self.handlers):
+            self.disconnect(event)
+
+    def track(self, key, capacity=100):
+        """Keeps the history of a numeric key, in a RingBuffer of its last
+        capacity values (returned; the existing one if already tracked)."""
+        if key not in self.tracks:
+            history = RingBuffer(capacity)
+
+            def on_value(value):
+                try:
+                    history.append(float(value))
+                except (ValueError, TypeError):
+                    pass  # Not a number
+            self.tracks[key] = (history, self.connect(key, on_value))
+        return self.tracks[key][0]
+
+    def untrack(self, key):
+        "Stops keeping the history of a key."
+        if key in self.tracks:
+            self.disconnect(key, self.tracks.pop(key)[1])
+
+    def get(self, key):
+        "Gets ALMemory value."
+        return self.almemory.getData(key)
+
+    def get_int(self, key):
+        "Gets ALMemory value, cast as int."
+        try:
+            return int(self.get(key))
+        except RuntimeError:
+            # Key doesn't exist
+            return 0
+        except ValueError:
+            # Key exists, but can't be parsed to int
+            return 0
+
+    def get_many(self, keys, default=None):
+        """Gets several ALMemory values in a single call, as a list.
+
+        Keys that don't exist get default."""
+        keys = list(keys)
+        try:
+            return list(self.almemory.getListData(keys))
+        except RuntimeError:
+            # A key doesn't exist; only then fall back to reading one by one
+            values = []
+            for key in keys:
+                try:
+                    values.append(self.get(key))
+                except RuntimeError:
+                    values.append(default)
+            return values
+
+    def get_ints(self, keys, default=0):
+        "Gets several ALMemory values in a single call, cast as ints."
+        return [_cast(int, value, default)
+                for value in self.get_many(keys, default)]
+
+    def get_floats(self, keys, default=0.0):
+        "Gets several ALMemory values in a single call, cast as floats."
+        return [_cast(float, value, default)
+                for value in self.get_many(keys, default)]
+
+    def set(self, key, value):
+        "Sets value of ALMemory key."
+        return self.almemory.raiseEvent(key, value)
+
+    def remove(self, key):
+        "Remove key from ALMemory."
+        try:
+            self.almemory.removeData(key)
+        except RuntimeError:
+            pass
+
+    def _on_wait(self, event, value):
+        "Internal - callback for an event being waited for."
+        done = []
+        with self.wait_lock:
+            for wait in list(self.waits.get(event, ())):
+                promise, predicate, events, any_event = wait
+                try:
+                    if predicate and not predicate(value):
+                        continue
+                except Exception:
+                    traceback.print_exc()
+                    continue
+                for wait_event in events:
+                    waits = self.waits.get(wait_event, [])
+                    if wait in waits:
+                        waits.remove(wait)
+                done.append((promise, (event, value) if any_event else value))
+        for promise, result in done:
+            promise.setValue(result)
+
+    def _wait_callback(self, event):
+        "Internal - returns the callback of an event being waited for."
+        if "." in event:  # it's a signal
+            return lambda *args: self._on_wait(event, args)
+        return lambda value: self._on_wait(event, value)
+
+    def _start_wait(self, events, predicate=None, any_event=False,
+                    subscribe=False):
+        """Internal - registers a wait for one of the events.
+
+        Waits share a connection per event, which is kept afterwards (until
+        disconnected, i.e. by clear()) for the next waits. With subscribe,
+        they also share the ALMemory subscription, until the last of them
+        ends. Returns the promise, and the events subscribed to for this
+        wait."""
+        events = tuple(OrderedDict.fromkeys(events))  # without duplicates
+        promise = qi.Promise()
+        wait = (promise, predicate, events, any_event)
+        with self.wait_lock:
+            for event in events:
+                self.waits.setdefault(event, []).append(wait)
+        subscribed = []
+        for event in events:
+            with self.wait_connect_lock:
+                if event not in self.wait_connections:
+                    self.wait_connections[event] = self.connect(
+                        event, self._wait_callback(event))
+                if subscribe:
+                    # For the side effects (i.e. WordRecognized)
+                    count = self.wait_subscriptions.get(event, 0)
+                    if not count:
+                        self.almemory.subscribeToEvent(
+                            event, "EVENTHELPER",
+                            "on_" + event.replace("/", ""))
+                    self.wait_subscriptions[event] = count + 1
+                    subscribed.append(event)
+        return promise, subscribed
+
+    def _end_wait(self, promise, subscribed):
+        "Internal - unregisters a wait (if still there)."
+        with self.wait_lock:
+            for event, waits in self.waits.items():
+                waits[:] = [wait for wait in waits if wait[0] is not promise]
+        for event in subscribed:
+            with self.wait_connect_lock:
+                count = self.wait_subscriptions.pop(event) - 1
+                if count:
+                    self.wait_subscriptions[event] = count
+                else:
+                    self.almemory.unsubscribeToEvent(event, "EVENTHELPER")
+
+    @staticmethod
+    def _wait_value(promise, timeout):
+        "Internal - waits for a promise, for timeout seconds (if not None)."
+        future = promise.future()
+        if timeout is None:
+            return future.value()
+        try:
+            return future.value(max(int(timeout * 1000), 0))
+        except RuntimeError:
+            if not future.isFinished():
+                raise WaitTimeout("Timed out waiting for an event")
+            raise
+
+    def cancel_wait(self):
+        "Cancel the current waits (raises an exception in waiting threads)"
+        with self.wait_lock:
+            promises = set(wait[0] for waits in self.waits.values()
+                           for wait in waits)
+            self.waits.clear()
+        for promise in promises:
+            promise.setCanceled()
+
+    def wait_for(self, event, subscribe=False, timeout=None, predicate=None):
+        """Block until a certain event is raised, and returns it's value.
+
+        If you pass subscribe=True, ALMemory.subscribeToEvent will be called
+        (sometimes necessary for side effects, i.e. WordRecognized).
+
+        With a predicate, only values for which it returns True count (i.e.
+        predicate=bool). With a timeout (in seconds), raises WaitTimeout if
+        no such value came in time. Several threads can wait at once.
+
+        This will block a thread so you should avoid doing this too often!
+        """
+        promise, subscribed = self._start_wait(
+            (event,), predicate, subscribe=subscribe)
+        try:
+            return self._wait_value(promise, timeout)
+        finally:
+            self._end_wait(promise, subscribed)
+
+    def wait_for_any(self, events, timeout=None, predicate=None):
+        """Block until one of the events is raised; returns (event, value).
+
+        timeout and predicate work as for wait_for."""
+        promise, subscribed = self._start_wait(
+            tuple(events), predicate, any_event=True)
+        try:
+            return self._wait_value(promise, timeout)
+        finally:
+            self._end_wait(promise, subscribed)
+
+    def wait_for_all(self, events, timeout=None, predicate=None):
+        """Block until each of the events was raised (since the call), and
+        returns {event: value}, with the first value of each.
+
+        timeout (for all of them) and predicate work as for wait_for."""
+        waits = [(event, self._start_wait((event,), predicate))
+                 for event in events]
+        deadline = None if timeout is None else time.time() + timeout
+        values = {}
+        try:
+            for event, (promise, _) in waits:
+                remaining = None if deadline is None \
+                    else deadline - time.time()
+                if remaining is not None and remaining <= 0 \
+                        and not promise.future().isFinished():
+                    raise WaitTimeout("Timed out waiting for " + event)
+                values[event] = self._wait_value(promise, remaining)
+        finally:
+            for _, (promise, subscribed) in waits:
+                self._end_wait(promise, subscribed)
+        return values
+
+class MemoryCache(object):
+    """A read-through cache of ALMemory values, kept fresh by events.
+
+    Usage:
+
+    values = MemoryCache(events, capacity=100)
+    values.get("MyMemoryKey")  # Reads ALMemory, and subscribes to the key
+    values.get("MyMemoryKey")  # Local: the subscription keeps it up to date
+
+    This only works for keys that are raised as events (with raiseEvent, as
+    EventHelper.set does), not for keys only written with insertData. When
+    more than capacity keys are cached, the least recently read one is
+    dropped and its subscription disconnected.
+    """
+
+    def __init__(self, events, capacity=64):
+        self.events = events
+        self.capacity = capacity
+        self.values = OrderedDict()  # key -> value, least recently read first
+        self.connections = {}  # key -> connection id (None while connecting)
+        self.lock = threading.Lock()
+        self.miss_lock = threading.Lock()  # Only one key is added at a time
+
+    def _on_value(self, key, value):
+        "Internal - callback for a cached key."
+        with self.lock:
+            if key in self.connections:
+                self.values[key] = value
+
+    def get(self, key):
+        "Gets ALMemory value, from the cache if possible."
+        with self.lock:
+            if key in self.values:
+                return self._touch(key, self.values[key])
+        with self.miss_lock:
+            with self.lock:
+                if key in self.values:  # Another thread just read it
+                    return self._touch(key, self.values[key])
+                self.connections[key] = None
+            # Connect before reading, so no change can be missed
+            connection_id = self.events.connect(
+                key, lambda value: self._on_value(key, value))
+            try:
+                value = self.events.get(key)
+            except RuntimeError:
+                # Key doesn't exist
+                with self.lock:
+                    del self.connections[key]
+                    self.values.pop(key, None)
+                self.events.disconnect(key, connection_id)
+                raise
+            with self.lock:
+                self.connections[key] = connection_id
+                # If an event arrived meanwhile, its value is at least as
+                # recent as the one read
+                value = self._touch(key, self.values.get(key, value))
+                evicted = self._evict()
+        for evicted_key, evicted_id in evicted:
+            self.events.disconnect(evicted_key, evicted_id)
+        return value
+
+    def set(self, key, value):
+        "Sets value of ALMemory key (and of the cache, if it holds it)."
+        result = self.events.set(key, value)
+        with self.lock:
+            if key in self.values:
+                self._touch(key, value)
+        return result
+
+    def _touch(self, key, value):
+        "Internal - sets a value, as the most recently read one."
+        self.values.pop(key, None)
+        self.values[key] = value
+        return value
+
+    def _evict(self):
+        "Internal - removes the least recently read keys beyond capacity."
+        evicted = []
+        while len(self.values) > self.capacity:
+            key, _ = self.values.popitem(last=False)
+            evicted.append((key, self.connections.pop(key)))
+        return evicted
+
+    def clear(self):
+        "Empties the cache, disconnecting all its subscriptions."
+        with self.lock:
+            evicted = [(key, self.connections.pop(key))
+                       for key in list(self.values)]
+            self.values.clear()
+        for key, connection_id in evicted:
+            self.events.disconnect(key, connection_id)
+
+
+class EventRecorder(object):
+    """Appends events to a compact binary log, for replaying them later.
+
+    Usage:
+
+    recorder = EventRecorder("events.log")
+    events.start_recording(recorder)
+    ...
+    events.stop_recording()
+    recorder.close()
+
+    The log starts with LOG_MAGIC, followed by records of a RECORD header
+    (kind, key id, timestamp, payload size) and a payload. Each key is only
+    written once in full, in a KEY record (its name as payload); EVENT
+    records carry the marshalled arguments of the event. Values marshal
+    can't encode are recorded as their repr().
+    """
+    LOG_MAGIC = b"STKEVT1\n"
+    RECORD = struct.Struct("<BHdI")
+    KEY, EVENT = 0, 1
+
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        self.lock = threading.Lock()
+        self.key_ids = {}
+        if self.file.tell() == 0:
+            self.file.write(self.LOG_MAGIC)
+        else:
+            # Appending: key ids must go on from the existing log
+            for _ in read_event_log(path, self.key_ids):
+                pass
+
+    def record(self, event, args, timestamp=None):
+        "Appends an event (with the arguments passed to its callbacks)."
+        try:
+            payload = marshal.dumps(args, 2)
+        except ValueError:
+            payload = marshal.dumps(tuple(repr(arg) for arg in args), 2)
+        timestamp = timestamp or time.time()
+        with self.lock:
+            key_id = self.key_ids.get(event)
+            if key_id is None:
+                key_id = self.key_ids[event] = len(self.key_ids)
+                name = event.encode("utf-8")
+                self.file.write(self.RECORD.pack(self.KEY, key_id, 0.0,
+                                                 len(name)) + name)
+            self.file.write(self.RECORD.pack(self.EVENT, key_id, timestamp,
+                                             len(payload)) + payload)
+
+    def close(self):
+        "Closes the log."
+        with self.lock:
+            self.file.close()
+
+
+def read_event_log(path, key_ids=None):
+    """Reads a log written by EventRecorder.
+
+    Yields (event, timestamp, args) for each event; if a dict is given as
+    key_ids, it is filled with the ids of the keys."""
+    header = EventRecorder.RECORD
+    names = {}
+    with open(path, "rb") as log:
+        if log.read(len(EventRecorder.LOG_MAGIC)) != EventRecorder.LOG_MAGIC:
+            raise ValueError("Not an event log: " + path)
+        while True:
+            record = log.read(header.size)
+            if len(record) < header.size:
+                return  # The end (maybe of a log being written)
+            kind, key_id, timestamp, size = header.unpack(record)
+            payload = log.read(size)
+            if len(payload) < size:
+                return
+            if kind == EventRecorder.KEY:
+                names[key_id] = payload.decode("utf-8")
+                if key_ids is not None:
+                    key_ids[names[key_id]] = key_id
+            else:
+                yield names[key_id], timestamp, marshal.loads(payload)
+
+
+class LocalSignal(object):
+    "A signal calling its callbacks synchronously, in the emitting thread."
+
+    def __init__(self):
+        self.callbacks = OrderedDict()
+        self.connection_ids = itertools.count(1)
+
+    def connect(self, callback):
+        "Connects a callback; returns a connection id."
+        connection_id = next(self.connection_ids)
+        self.callbacks[connection_id] = callback
+        return connection_id
+
+    def disconnect(self, connection_id):
+        "Disconnects a callback."
+        return self.callbacks.pop(connection_id, None) is not None
+
+    def __call__(self, *args):
+        for callback in list(self.callbacks.values()):
+            callback(*args)
+
+
+class ReplaySubscriber(object):
+    "What ReplayMemory.subscriber returns."
+
+    def __init__(self, signal):
+        self.signal = signal
+
+
+class ReplayMemory(object):
+    "A local stand-in for ALMemory, for replaying events."
+
+    def __init__(self):
+        self.data = {}
+        self.signals = {}
+
+    def subscriber(self, key):
+        "Returns an object whose .signal is raised with the key's values."
+        return ReplaySubscriber(self.signals.setdefault(key, LocalSignal()))
+
+    def raiseEvent(self, key, value):
+        self.data[key] = value
+        if key in self.signals:
+            self.signals[key](value)
+
+    def insertData(self, key, value):
+        self.data[key] = value
+
+    def getData(self, key):
+        if key not in self.data:
+            raise RuntimeError("ALMemory has no key " + key)
+        return self.data[key]
+
+    def getListData(self, keys):
+        return [self.getData(key) for key in keys]
+
+    def removeData(self, key):
+        self.data.pop(key, None)
+
+    def subscribeToEvent(self, key, name, method):
+        pass
+
+    def unsubscribeToEvent(self, key, name):
+        pass
+
+
+class ReplayService(object):
+    "A local stand-in for a service, whose attributes are LocalSignals."
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        signal = LocalSignal()
+        setattr(self, name, signal)
+        return signal
+
+
+class ReplaySession(object):
+    """A local stand-in for a NAOqi session, for replaying events.
+
+    Usage:
+
+    session = ReplaySession()
+    events = EventHelper(session)
+    events.connect_decorators(my_handlers)
+    count, duration = session.replay("events.log", speed=None)
+    """
+
+    def __init__(self):
+        self.services = {"ALMemory": ReplayMemory()}
+
+    def service(self, name):
+        "Returns a local stand-in for the service."
+        if name not in self.services:
+            self.services[name] = ReplayService()
+        return self.services[name]
+
+    def raise_event(self, event, args):
+        "Raises an ALMemory event or signal, calling callbacks right away."
+        if "." in event:
+            service_name, signal_name = event.split(".")
+            getattr(self.service(service_name), signal_name)(*args)
+        else:
+            self.services["ALMemory"].raiseEvent(event, *args)
+
+    def replay(self, path, speed=1.0):
+        """Raises the events of a log (see EventRecorder) again.
+
+        speed=1.0 keeps the recorded timing, 10.0 is ten times faster, and
+        None is as fast as possible. Returns (number of events, seconds).
+        """
+        start = time.time()
+        first = None
+        count = 0
+        for event, timestamp, args in read_event_log(path):
+            if speed:
+                if first is None:
+                    first = timestamp
+                delay = (timestamp - first) / speed - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            self.raise_event(event, args)
+            count += 1
+        return count, time.time() - start
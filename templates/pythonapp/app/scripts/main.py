@@ -36,8 +36,7 @@ class Activity(object):
         # 1) block until it's called
         self.s.ALTextToSpeech.say("Touch my forehead.")
         self.logger.warning("Listening for touch...")
-        while not self.events.wait_for("FrontTactilTouched"):
-            pass
+        self.events.wait_for("FrontTactilTouched", predicate=bool)
 
         # 2) explicitly connect a callback
         if self.s.ALTabletService:
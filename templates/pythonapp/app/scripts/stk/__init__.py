@@ -1,3 +0,0 @@
-"""
-STK - A collection of libraries useful for making apps with NAOqi.
-"""